@@ -0,0 +1,80 @@
+"""
+Compares writing obstacles and grass inline against as <include>s of shared models: how long
+the world takes to write, how big it is, and how long it takes to parse. Parsing is a rough
+stand-in for gazebo's load time, which also has to resolve every include (but only loads
+each shared model once). Run from the project root, e.g.
+
+    python -m benchmarks.instance_modes --counts 1000 10000 50000
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from lxml import etree
+from pcg_gazebo.simulation import World
+from util.world_writer import INSTANCE_MODES, write_world
+
+
+def benchmark_instance_modes(counts, modes=INSTANCE_MODES):
+    """
+    Writes `count` instances, a third each of rocks, trees and grass
+
+    @returns a list of {"count", "mode", "write_seconds", "parse_seconds", "bytes"} results
+    """
+    results = []
+    for count in counts:
+        rng = np.random.default_rng(0)
+        obstacle_count = count * 2 // 3
+        names = ["rock", "tree"] * (obstacle_count // 2)
+        positions = rng.random((len(names), 3)) * 100
+        grass_positions = rng.random((count - len(names), 3)) * 100
+        for mode in modes:
+            world = World().to_sdf(with_default_sun=True)
+            with tempfile.TemporaryDirectory() as world_dir:
+                world_path = Path(world_dir, "benchmark.world")
+                start = time.perf_counter()
+                write_world(
+                    world,
+                    world_path,
+                    names,
+                    positions,
+                    grass_positions,
+                    np.random.default_rng(0),
+                    mode,
+                )
+                write_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                etree.parse(str(world_path))
+                parse_seconds = time.perf_counter() - start
+                size = world_path.stat().st_size
+            results.append(
+                {
+                    "count": count,
+                    "mode": mode,
+                    "write_seconds": write_seconds,
+                    "parse_seconds": parse_seconds,
+                    "bytes": size,
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--modes", nargs="+", default=INSTANCE_MODES)
+    args = parser.parse_args()
+
+    print(f"{'count':>8} {'mode':>8} {'write s':>9} {'parse s':>9} {'MB':>9}")
+    for result in benchmark_instance_modes(args.counts, args.modes):
+        print(
+            f"{result['count']:>8} {result['mode']:>8}"
+            + f" {result['write_seconds']:>9.3f} {result['parse_seconds']:>9.3f}"
+            + f" {result['bytes'] / 1024**2:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
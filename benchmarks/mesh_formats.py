@@ -0,0 +1,60 @@
+"""
+Compares how long the ground mesh takes to write, and how big the file is, for each export
+format. Run from the project root, e.g.
+
+    python -m benchmarks.mesh_formats --resolutions 256 512 1024
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from util.export_terrain import MESH_FORMATS, export_mesh_file
+from util.generate_mesh import create_ground_mesh
+
+
+def benchmark_mesh_formats(resolutions, formats=MESH_FORMATS):
+    """
+    @returns a list of {"resolution", "format", "seconds", "bytes"} results
+    """
+    results = []
+    rng = np.random.default_rng(0)
+    for resolution in resolutions:
+        noise_map = rng.random((resolution, resolution))
+        mesh = create_ground_mesh(noise_map, resolution=resolution)
+        for mesh_format in formats:
+            with tempfile.TemporaryDirectory() as model_path:
+                start = time.perf_counter()
+                model_name = export_mesh_file(mesh, model_path, mesh_format)
+                seconds = time.perf_counter() - start
+                size = Path(model_path, model_name).stat().st_size
+            results.append(
+                {
+                    "resolution": resolution,
+                    "format": mesh_format,
+                    "seconds": seconds,
+                    "bytes": size,
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--resolutions", type=int, nargs="+", default=[128, 256, 512, 1024]
+    )
+    parser.add_argument("--formats", nargs="+", default=MESH_FORMATS)
+    args = parser.parse_args()
+
+    print(f"{'resolution':>10} {'format':>6} {'seconds':>9} {'MB':>9}")
+    for result in benchmark_mesh_formats(args.resolutions, args.formats):
+        print(
+            f"{result['resolution']:>10} {result['format']:>6}"
+            + f" {result['seconds']:>9.3f} {result['bytes'] / 1024**2:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+Times each stage of generating and exporting a world across a matrix of resolutions, noise
+types and obstacle/grass counts. Needs no display, so it runs on a headless linux box.
+Run from the project root, e.g.
+
+    python -m benchmarks.pipeline --output results.json
+    python -m benchmarks.pipeline --baseline results.json --threshold 0.1
+
+Each case runs in its own process, so caches and memory from one case never leak into the
+next. For each case it reports:
+- `seconds`/`min_seconds` - the median and fastest wall time of `--repeats` runs
+- `peak_rss_bytes` - how far the process' peak resident memory rose during the runs
+- `traced_peak_bytes` - the most memory python and numpy had allocated at once in one run
+- `retained_blocks` - how many allocations from one run are still alive once it returns
+
+With `--baseline`, the results are compared to an earlier `--output` and the exit code is 1
+if any case got more than `--threshold` slower or bigger.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from util.generate_mesh import (
+    _create_faces,
+    clamp_angle,
+    create_ground_mesh,
+    create_vertices,
+    find_closest_z,
+    place_grass,
+    place_rocks,
+    place_trees,
+)
+from util.noise_generators import custom_noise
+
+STAGES = [
+    "noise",
+    "vertices",
+    "faces",
+    "clamp_angle",
+    "clamp_angle_local",
+    "ground_mesh",
+    "find_closest_z",
+    "placement",
+    "export_world",
+]
+# the settings each stage depends on, so the matrix only repeats a stage when it matters
+STAGE_PARAMS = {
+    "noise": ["resolution", "noise_type"],
+    "vertices": ["resolution"],
+    "faces": ["resolution"],
+    "clamp_angle": ["resolution"],
+    "clamp_angle_local": ["resolution"],
+    "ground_mesh": ["resolution"],
+    "find_closest_z": ["resolution", "obstacles", "grass"],
+    "placement": ["resolution", "obstacles", "grass"],
+    "export_world": ["resolution", "obstacles", "grass"],
+}
+COMPARED_METRICS = ["seconds", "peak_rss_bytes"]
+# changes smaller than these are noise rather than regressions, whatever the threshold
+MIN_CHANGES = {"seconds": 0.001, "peak_rss_bytes": 1024**2}
+# steep enough that the angle clamp has work to do
+BENCHMARK_MAX_ANGLE = 30
+
+
+def create_noise(resolution, noise_type="Perlin"):
+    return custom_noise(resolution, noise_type, seed=0)
+
+
+def create_benchmark_mesh(resolution):
+    return create_ground_mesh(create_noise(resolution), resolution)
+
+
+def setup_stage(stage, work_dir, resolution, noise_type="Perlin", obstacles=0, grass=0):
+    """
+    Builds everything `stage` needs, so only the stage itself is timed
+
+    :param work_dir str: an empty directory the stage can write to
+
+    @returns a function that runs the stage once
+    """
+    if stage == "noise":
+        return lambda: create_noise(resolution, noise_type)
+    if stage == "vertices":
+        noise = create_noise(resolution)
+        return lambda: create_vertices(noise, resolution)
+    if stage == "faces":
+
+        def run_faces():
+            # faces are cached per resolution, which would leave nothing to time
+            _create_faces.cache_clear()
+            return _create_faces(resolution)
+
+        return run_faces
+    if stage in ["clamp_angle", "clamp_angle_local"]:
+        vertices = create_vertices(create_noise(resolution), resolution)
+        local = stage == "clamp_angle_local"
+        return lambda: clamp_angle(vertices, BENCHMARK_MAX_ANGLE, resolution, local)
+    if stage == "ground_mesh":
+        noise = create_noise(resolution)
+        return lambda: create_ground_mesh(noise, resolution)
+
+    mesh = create_benchmark_mesh(resolution)
+    if stage == "find_closest_z":
+        points = np.random.default_rng(0).uniform(-5, 5, (obstacles + grass, 2))
+        return lambda: find_closest_z(mesh, points)
+    if stage == "placement":
+        displacement = [-5, 5]
+
+        def run_placement():
+            rng = np.random.default_rng(0)
+            return (
+                place_rocks(obstacles // 2, displacement, displacement, mesh, rng),
+                place_trees(obstacles // 2, displacement, displacement, mesh, rng),
+                place_grass(grass, displacement, displacement, mesh, rng),
+            )
+
+        return run_placement
+    if stage == "export_world":
+        return setup_export_world(work_dir, resolution, obstacles, grass)
+    raise ValueError(f"unknown stage '{stage}', expected one of {STAGES}")
+
+
+def setup_export_world(work_dir, resolution, obstacles, grass):
+    # imported here so the other stages don't need pcg_gazebo
+    from controllers.terrain_generator import TerrainGeneratorController
+    from models.terrain_generator import TerrainGeneratorModel
+    from util.heightmap_cache import heightmap_cache
+
+    # models are exported to ~/.gazebo/models, so point home somewhere disposable. This only
+    # changes the environment of the process running the case
+    os.environ["HOME"] = work_dir
+    controller = TerrainGeneratorController(TerrainGeneratorModel())
+    controller.apply_settings(
+        {
+            "resolution": resolution,
+            "total_obstacles": obstacles,
+            "total_grass": grass,
+        }
+    )
+
+    def run_export_world():
+        # every repeat generates the heightmap again, rather than timing a cache hit
+        heightmap_cache.clear()
+        # keep "world exported" out of the results table
+        with contextlib.redirect_stdout(None):
+            return controller.export_world("benchmark", world_dir=work_dir, force=True)
+
+    return run_export_world
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident memory linux keeps for this process
+
+    @returns False if it can't be reset, so the peak includes everything before it
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_rss():
+    """@returns the (current, peak) resident memory of this process in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        return (
+            int(status["VmRSS"].split()[0]) * 1024,
+            int(status["VmHWM"].split()[0]) * 1024,
+        )
+    except (OSError, KeyError):
+        # linux reports ru_maxrss in KiB
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return peak, peak
+
+
+def run_case(stage, params, repeats=3):
+    """
+    Runs in its own process. Times `stage` `repeats` times, then runs it once more while
+    tracing allocations, as tracing slows it down too much to time
+
+    @returns the case's result, see the module docstring
+    """
+    with tempfile.TemporaryDirectory(prefix="terrain-benchmark-") as work_dir:
+        run = setup_stage(stage, work_dir, **params)
+        reset_peak_rss()
+        rss_start = get_rss()[0]
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        peak_rss = get_rss()[1]
+
+        tracemalloc.start()
+        result = run()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        # only allocations made since tracing started are in the snapshot
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        del result
+    return {
+        "stage": stage,
+        "params": params,
+        "seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "repeats": repeats,
+        "peak_rss_bytes": max(peak_rss - rss_start, 0),
+        "traced_peak_bytes": traced_peak,
+        "retained_blocks": sum(stat.count for stat in snapshot.statistics("filename")),
+    }
+
+
+def get_cases(stages, resolutions, noise_types, obstacle_counts, grass_counts):
+    """@returns a (stage, params) pair for every case in the matrix"""
+    values = {
+        "resolution": resolutions,
+        "noise_type": noise_types,
+        "obstacles": obstacle_counts,
+        "grass": grass_counts,
+    }
+    cases = []
+    for stage in stages:
+        keys = STAGE_PARAMS[stage]
+        for combination in itertools.product(*(values[key] for key in keys)):
+            cases.append((stage, dict(zip(keys, combination))))
+    return cases
+
+
+def benchmark_pipeline(cases, repeats=3):
+    """
+    Runs each case in a new process, yielding its result as soon as it finishes
+    """
+    # forked, so each case starts with the modules already imported
+    context = multiprocessing.get_context("fork")
+    for stage, params in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            yield executor.submit(run_case, stage, params, repeats).result()
+
+
+def get_environment():
+    """What the results were measured on, as results only compare on the same machine"""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def get_case_key(result):
+    return result["stage"], tuple(sorted(result["params"].items()))
+
+
+def compare_results(results, baseline_results, threshold=0.1):
+    """
+    Compares each result to the same case in the baseline. Cases missing from either are
+    skipped
+
+    :param threshold float: how much bigger a metric may get before it's a regression,
+    e.g. 0.1 for 10%
+
+    @returns a list of {"stage", "params", "metric", "baseline", "value", "change"} for
+    every regression
+    """
+    baseline = {get_case_key(result): result for result in baseline_results}
+    regressions = []
+    for result in results:
+        previous = baseline.get(get_case_key(result))
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            value, baseline_value = result[metric], previous[metric]
+            if value - baseline_value <= MIN_CHANGES[metric]:
+                continue
+            if value > baseline_value * (1 + threshold):
+                regressions.append(
+                    {
+                        "stage": result["stage"],
+                        "params": result["params"],
+                        "metric": metric,
+                        "baseline": baseline_value,
+                        "value": value,
+                        "change": (
+                            value / baseline_value - 1
+                            if baseline_value
+                            else float("inf")
+                        ),
+                    }
+                )
+    return regressions
+
+
+def format_params(params):
+    return " ".join(f"{key}={value}" for key, value in params.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument(
+        "--resolutions", type=int, nargs="+", default=[48, 256, 1024, 2048]
+    )
+    parser.add_argument(
+        "--noise-types", nargs="+", default=["Perlin", "SimplexFractal", "Cellular"]
+    )
+    parser.add_argument("--obstacles", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--grass", type=int, nargs="+", default=[0, 10000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--baseline", help="a json file from an earlier --output")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="fraction a case may get slower or bigger than the baseline (default: 0.1)",
+    )
+    args = parser.parse_args()
+
+    cases = get_cases(
+        args.stages, args.resolutions, args.noise_types, args.obstacles, args.grass
+    )
+    print(
+        f"{'stage':>18} {'seconds':>9} {'min s':>9} {'RSS MB':>9} {'traced MB':>9}"
+        + f" {'blocks':>9}  params"
+    )
+    results = []
+    for result in benchmark_pipeline(cases, args.repeats):
+        results.append(result)
+        print(
+            f"{result['stage']:>18} {result['seconds']:>9.4f}"
+            + f" {result['min_seconds']:>9.4f}"
+            + f" {result['peak_rss_bytes'] / 1024**2:>9.1f}"
+            + f" {result['traced_peak_bytes'] / 1024**2:>9.1f}"
+            + f" {result['retained_blocks']:>9}  {format_params(result['params'])}"
+        )
+
+    environment = get_environment()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment, "results": results}, f, indent=2)
+        print(f"results written to {args.output}")
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != environment:
+        print("warning: the baseline was measured in a different environment")
+    regressions = compare_results(results, baseline["results"], args.threshold)
+    for regression in regressions:
+        print(
+            f"regression: {regression['stage']} {format_params(regression['params'])}"
+            + f" {regression['metric']} {regression['baseline']:.4g}"
+            + f" -> {regression['value']:.4g} ({regression['change']:+.0%})"
+        )
+    print(f"{len(regressions)} regressions above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
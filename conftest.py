@@ -0,0 +1,2 @@
+# Keeps the project root on sys.path, so the tests can import `util` etc. when run with plain
+# `pytest` as well as `python -m pytest`
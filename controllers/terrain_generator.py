@@ -1,25 +1,83 @@
+from contextlib import contextmanager
+import functools
 from pathlib import Path
 import shutil
-from pcg_gazebo.parsers.sdf import create_sdf_element
 from pcg_gazebo.simulation import World
 from models.terrain_generator import TerrainGeneratorModel
 from util.sdf_creator import (
-    create_grass_sdf,
     create_ground_sdf,
-    create_rock_sdf,
-    create_tree_sdf,
+    create_heightmap_sdf,
 )
-import numpy as np
 import yaml
+from util.export_cache import get_export_hash, is_export_current, write_manifest
+from util.export_terrain import (
+    GROUND_TYPES,
+    MESH_FORMATS,
+    export_heightmap_png,
+    export_mesh_file,
+)
+from util.generate_mesh import simplify_ground_mesh
+from util.heightmap_cache import canonical_noise_options, heightmap_cache
+from util.instrumentation import instrumentation, span
 from util.terrain_defaults import settings
+from util.world_writer import INSTANCE_MODES, export_instance_models, write_world
+
+
+def read_generator_settings(filepath):
+    """
+    Reads a yml settings preset (see ./assets/setting-presets) into a settings dict.
+    Settings missing from the file use the defaults.
+    """
+    with open(filepath, "r") as stream:
+        yml_settings = yaml.safe_load(stream) or {}
+    # we use get here because the yml setting may not exist
+    # whereas the default setting will always exist. Falsy values such as 0 are kept
+    get_setting = lambda x: yml_settings.get(x, settings[x])
+    keys = [
+        "depth",
+        "width",
+        "height_multiplier",
+        "resolution",
+        "scale",
+        "seed",
+        "max_angle",
+        "local_clamp",
+        "tiles",
+        "mesh_format",
+        "ground_type",
+        "max_error",
+        "collision_max_error",
+        "instance_mode",
+        "noise_type",
+        "noise_options",
+        "tree_density",
+        "rock_density",
+        "total_obstacles",
+        "total_grass",
+    ]
+    return {key: get_setting(key) for key in keys}
 
 
 def emit_value_change(func):
+    """For setters that change the heightmap. The noise is regenerated once the change is applied"""
+
+    @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         result = func(self, *args, **kwargs)
-        self.generate_procedural_array()
-        if self.on_value_change:
-            self.on_value_change()
+        self._is_heightmap_dirty = True
+        self.apply_pending_changes()
+        return result
+
+    return wrapper
+
+
+def emit_setting_change(func):
+    """For setters that don't change the heightmap, e.g. obstacle counts, so noise isn't regenerated"""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        result = func(self, *args, **kwargs)
+        self.apply_pending_changes()
         return result
 
     return wrapper
@@ -34,16 +92,21 @@ class TerrainGeneratorController:
         self.view = None
         self.callback = None
         self.on_value_change = None
+        # when set, regenerating the heightmap is handed to this instead of done in the setter
+        self.on_heightmap_change = None
+        # while > 0, setters only mark what changed and regeneration waits until the batch ends
+        self._batch_depth = 0
+        self._is_heightmap_dirty = False
         self.load_generator_settings("Default.yml")
         # make sure these dirs exist
         model_path = Path(Path.cwd(), "assets", "setting-presets")
         model_path.mkdir(exist_ok=True)
 
-    @emit_value_change
+    @emit_setting_change
     def set_width(self, value):
         self.model.set_width(value)
 
-    @emit_value_change
+    @emit_setting_change
     def set_depth(self, value):
         self.model.set_depth(value)
 
@@ -60,22 +123,54 @@ class TerrainGeneratorController:
         self.model.set_noise_options(options)
 
     @emit_value_change
+    def set_seed(self, value):
+        self.model.set_seed(value)
+
+    @emit_setting_change
     def set_max_angle(self, value):
         self.model.set_max_angle(value)
 
-    @emit_value_change
+    @emit_setting_change
+    def set_local_clamp(self, value):
+        self.model.set_local_clamp(value)
+
+    @emit_setting_change
+    def set_tiles(self, value):
+        self.model.set_tiles(value)
+
+    @emit_setting_change
+    def set_mesh_format(self, value):
+        self.model.set_mesh_format(value)
+
+    @emit_setting_change
+    def set_ground_type(self, value):
+        self.model.set_ground_type(value)
+
+    @emit_setting_change
+    def set_instance_mode(self, value):
+        self.model.set_instance_mode(value)
+
+    @emit_setting_change
+    def set_max_error(self, value):
+        self.model.set_max_error(value)
+
+    @emit_setting_change
+    def set_collision_max_error(self, value):
+        self.model.set_collision_max_error(value)
+
+    @emit_setting_change
     def set_tree_density(self, value):
         self.model.set_tree_density(value)
 
-    @emit_value_change
+    @emit_setting_change
     def set_rock_density(self, value):
         self.model.set_rock_density(value)
 
-    @emit_value_change
+    @emit_setting_change
     def set_total_obstacles(self, value):
         self.model.set_total_obstacles(value)
 
-    @emit_value_change
+    @emit_setting_change
     def set_total_grass(self, value):
         self.model.set_total_grass(value)
 
@@ -83,16 +178,63 @@ class TerrainGeneratorController:
     def set_resolution(self, value):
         self.model.set_resolution(value)
 
-    @emit_value_change
+    @emit_setting_change
     def set_scale(self, value):
         self.model.set_scale(value)
 
+    @contextmanager
+    def batch_update(self):
+        """
+        Apply many setting changes and only regenerate once, e.g.
+
+            with controller.batch_update():
+                controller.set_resolution(128)
+                controller.set_noise_type("Simplex")
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            self.apply_pending_changes()
+
+    def apply_settings(self, new_settings):
+        """
+        Apply a dict of settings (same keys as the yml presets), regenerating at most once.
+        Keys without a setter are ignored.
+        """
+        with self.batch_update():
+            for key, value in new_settings.items():
+                setter = getattr(self, f"set_{key}", None)
+                if key in settings and setter:
+                    setter(value)
+
+    def apply_pending_changes(self):
+        if self._batch_depth > 0 or not self._is_heightmap_dirty:
+            return
+        self._is_heightmap_dirty = False
+        if self.on_heightmap_change:
+            self.on_heightmap_change()
+            return
+        self.generate_procedural_array()
+        if self.on_value_change:
+            self.on_value_change()
+
     def set_view(self, view):
         self.view = view
 
     def set_on_value_change(self, callback):
         self.on_value_change = callback
 
+    def set_on_heightmap_change(self, callback):
+        """
+        Let the view decide when and where the heightmap is regenerated, e.g. on a background
+        thread. The callback should use `get_heightmap_params`, `create_procedural_array` and
+        `set_procedural_array` to do so, or `get_preview_params` if it only needs a preview.
+        The full resolution heightmap is regenerated by `update_mesh` before it's needed.
+        """
+        self.on_heightmap_change = callback
+
     def get_depth(self):
         return self.model.get_depth()
 
@@ -158,9 +300,42 @@ class TerrainGeneratorController:
     def get_scale(self):
         return self.model.get_scale()
 
+    def get_seed(self):
+        return self.model.get_seed()
+
     def get_max_angle(self):
         return self.model.get_max_angle()
 
+    def get_local_clamp(self):
+        return self.model.get_local_clamp()
+
+    def get_tiles(self):
+        return self.model.get_tiles()
+
+    def get_mesh_format(self):
+        return self.model.get_mesh_format()
+
+    def get_mesh_formats(self):
+        return MESH_FORMATS
+
+    def get_ground_type(self):
+        return self.model.get_ground_type()
+
+    def get_ground_types(self):
+        return GROUND_TYPES
+
+    def get_instance_mode(self):
+        return self.model.get_instance_mode()
+
+    def get_instance_modes(self):
+        return INSTANCE_MODES
+
+    def get_max_error(self):
+        return self.model.get_max_error()
+
+    def get_collision_max_error(self):
+        return self.model.get_collision_max_error()
+
     def get_total_obstacles(self):
         return self.model.get_total_obstacles()
 
@@ -176,30 +351,31 @@ class TerrainGeneratorController:
     def get_procedural_array(self):
         return self.model.get_procedural_array()
 
+    def get_heightmap_params(self):
+        return self.model.get_heightmap_params()
+
+    def get_preview_params(self, size):
+        return self.model.get_preview_params(size)
+
+    def create_procedural_array(self, params):
+        return self.model.create_procedural_array(params)
+
+    def set_procedural_array(self, array):
+        self.model.set_procedural_array(array)
+
+    def get_heightmap_cache_stats(self):
+        return heightmap_cache.get_stats()
+
     def load_generator_settings(self, filename):
         filepath = filename if ".yml" in filename else f"{filename}.yml"
         try:
-            with open(f"./assets/setting-presets/{filepath}", "r") as stream:
-                try:
-                    yml_settings = yaml.safe_load(stream)
-                    # we use get here because the yml setting may not exist
-                    # whereas the default setting will always exist
-                    get_setting = lambda x: yml_settings.get(x) or settings[x]
-                    self.set_depth(get_setting("depth"))
-                    self.set_width(get_setting("width"))
-                    self.set_height_multiplier(get_setting("height_multiplier"))
-                    self.set_resolution(get_setting("resolution"))
-                    self.set_scale(get_setting("scale"))
-                    self.set_max_angle(get_setting("max_angle"))
-                    self.set_noise_type(get_setting("noise_type"))
-                    self.set_noise_options(get_setting("noise_options"))
-                    self.set_tree_density(get_setting("tree_density"))
-                    self.set_rock_density(get_setting("rock_density"))
-                    self.set_total_obstacles(get_setting("total_obstacles"))
-                except yaml.YAMLError as exc:
-                    print("Error: Could not load yml file")
-                    print(exc)
-
+            yml_settings = read_generator_settings(
+                f"./assets/setting-presets/{filepath}"
+            )
+            self.apply_settings(yml_settings)
+        except yaml.YAMLError as exc:
+            print("Error: Could not load yml file")
+            print(exc)
         except FileNotFoundError:
             print("file not found error")
             self.save_generator_settings("Default")
@@ -210,12 +386,21 @@ class TerrainGeneratorController:
             "width": self.get_width(),
             "resolution": self.get_resolution(),
             "scale": self.get_scale(),
+            "seed": self.get_seed(),
             "noise_options": self.get_noise_options(),
             "noise_type": self.get_noise_type(),
             "max_angle": self.get_max_angle(),
+            "local_clamp": self.get_local_clamp(),
+            "tiles": self.get_tiles(),
+            "mesh_format": self.get_mesh_format(),
+            "ground_type": self.get_ground_type(),
+            "max_error": self.get_max_error(),
+            "collision_max_error": self.get_collision_max_error(),
+            "instance_mode": self.get_instance_mode(),
             "tree_density": self.get_tree_density(),
             "rock_density": self.get_rock_density(),
             "total_obstacles": self.get_total_obstacles(),
+            "total_grass": self.get_total_grass(),
         }
         filepath = f"./assets/setting-presets/{filename}.yml"
         with open(filepath, "w") as f:
@@ -230,80 +415,180 @@ class TerrainGeneratorController:
         model_dir = Path(Path.home(), ".gazebo", "models")
         shutil.copytree(assets_dir, model_dir, dirs_exist_ok=True)
 
-    def export_world(self, custom_name=None):
+    def get_settings(self):
+        """Every setting that affects the generated world, in a canonical form"""
+        return {
+            "depth": self.get_depth(),
+            "width": self.get_width(),
+            "height_multiplier": self.get_height_multiplier(),
+            "resolution": self.get_resolution(),
+            "scale": self.get_scale(),
+            "seed": self.get_seed(),
+            "noise_type": self.get_noise_type(),
+            "noise_options": canonical_noise_options(self.get_noise_options()),
+            "max_angle": self.get_max_angle(),
+            "local_clamp": self.get_local_clamp(),
+            "tiles": self.get_tiles(),
+            "mesh_format": self.get_mesh_format(),
+            "ground_type": self.get_ground_type(),
+            "max_error": self.get_max_error(),
+            "collision_max_error": self.get_collision_max_error(),
+            "instance_mode": self.get_instance_mode(),
+            "tree_density": self.get_tree_density(),
+            "rock_density": self.get_rock_density(),
+            "total_obstacles": self.get_total_obstacles(),
+            "total_grass": self.get_total_grass(),
+        }
+
+    def export_world(
+        self, custom_name=None, world_dir="./worlds", force=False, max_workers=None
+    ):
+        """
+        Exports the ground mesh model and the world. If the same settings were already exported
+        to the same place the export is skipped, unless `force` is set.
+        `max_workers` limits the processes tiles are generated in, see `export_tiled_world`
+
+        @returns True if the world was exported, False if it was already up to date
+        """
         noise_type = self.model.get_noise_type().lower().replace(" ", "-")
         model_folder = custom_name or f"{noise_type}_terrain_mesh"
+        world_name = custom_name or f"{noise_type}_generated_world.world"
+        world_name = world_name if ".world" in world_name else f"{world_name}.world"
+        # times every stage of the export, see util/instrumentation
+        with instrumentation.run(world_name):
+            return self.export_world_files(
+                model_folder, world_name, world_dir, force, max_workers
+            )
+
+    def export_world_files(
+        self, model_folder, world_name, world_dir, force=False, max_workers=None
+    ):
+        """Exports the ground and the world under the given names, see `export_world`"""
+        if self.get_tiles() > 1:
+            # imported here as the tile workers import this module
+            from util.tiled_generation import export_tiled_world
+
+            return export_tiled_world(
+                self.get_settings(),
+                model_folder,
+                world_name,
+                world_dir,
+                max_workers=max_workers,
+                force=force,
+            )
+
         model_path = Path(Path.home(), ".gazebo", "models", model_folder)
-        model_path.mkdir(exist_ok=True)
-        ground_mesh = self.model.get_mesh()
-        if ground_mesh is None:
+        world_path = Path(world_dir, world_name)
+        export_hash = get_export_hash(self.get_settings(), model_folder, world_path)
+        if not force and is_export_current(model_path, export_hash):
+            print(f"{world_name} is up to date, skipping export")
+            return False
+
+        model_path.mkdir(parents=True, exist_ok=True)
+        # regenerate first, so the exported mesh and the obstacles placed on it match
+        self.model.update_mesh()
+        # draw from the world's own generator so exports are reproducible for a seed
+        rng = self.model.get_rng()
+        if self.model.get_mesh() is None:
             return print("Erorr: mesh does not exist")
 
-        # mesh mush be exported first so the path exists
-        ground_mesh.export(f"{model_path}/model.obj")
-        # create a link to the exported mesh
-        ground_mesh_uri = f"model://{model_folder}/model.obj"
-        ground_mesh = create_ground_sdf(
-            ground_mesh_uri,
-            "ground_mesh",
-            [0, 0, 0, 0, 0, 0],
-            "Gazebo/Grass",
-            [1, 1, 1],
-        )
-        self.model.update_mesh()
-        obstacles = self.model.get_obstacles()
-        world = World()
-        world = world.to_sdf(with_default_sun=True)
-        world.children["model"] = [ground_mesh]
-        for i, grass_mesh in enumerate(obstacles):
-            x, y, z = grass_mesh.metadata["displacement"]
-            model = None
-            if grass_mesh.metadata["name"] == "rock":
-                roll, pitch, yaw = np.random.rand(3)
-                model = create_rock_sdf(
-                    "model://rock/meshes/Rock1.dae",
-                    [
-                        "model://rock/materials/scripts/",
-                        "model://rock/materials/textures/",
-                    ],
-                    f"Rock_{i}",
-                    [x, y, z, roll, pitch, yaw],
-                    "Rock",
-                    [0.2, 0.2, 0.2],
+        ground_mesh, ground_files = self.export_ground(model_path, model_folder)
+        instance_files = []
+        if self.get_instance_mode() == "include":
+            with span("instance_models"):
+                instance_files = export_instance_models(model_path.parent)
+        # only the positions are needed, so the obstacle meshes are never loaded here
+        instances = self.model.get_instances()
+        with span("sdf_build"):
+            world = World()
+            world = world.to_sdf(with_default_sun=True)
+            world.children["model"] = [ground_mesh]
+        Path(world_dir).mkdir(parents=True, exist_ok=True)
+        # obstacles and grass are streamed into the file rather than added to the tree
+        with span("xml_write", instances=len(instances)):
+            write_world(
+                world,
+                world_path,
+                instances.get_names(["rock", "tree"]),
+                instances.get_positions(["rock", "tree"]),
+                instances.get_positions("grass"),
+                rng,
+                self.get_instance_mode(),
+            )
+        with span("manifest"):
+            write_manifest(
+                model_path,
+                export_hash,
+                [
+                    *(Path(model_path, f).resolve() for f in ground_files),
+                    *(path.resolve() for path in instance_files),
+                    world_path.resolve(),
+                ],
+            )
+        print("world exported")
+        return True
+
+    def export_ground(self, model_path, model_folder):
+        """
+        Writes the current ground mesh to `model_path` as a mesh file or a heightmap png,
+        depending on the ground type. `update_mesh` must be called first.
+
+        @returns the ground's sdf model and the names of the files it uses
+        """
+        ground_mesh = self.model.get_mesh()
+        if self.get_ground_type() == "heightmap":
+            # the heights after the angle clamp, so obstacles still sit on the ground
+            ground_file = "heightmap.png"
+            with span("heightmap_write"):
+                z_min, z_max = export_heightmap_png(
+                    ground_mesh.metadata["height_grid"], Path(model_path, ground_file)
+                )
+            width, depth = ground_mesh.metadata["size"]
+            with span("sdf_build"):
+                ground_model = create_heightmap_sdf(
+                    f"model://{model_folder}/{ground_file}",
+                    "ground_mesh",
+                    [width, depth, z_max - z_min],
+                    [0, 0, z_min],
                 )
-            else:
-                # only used for "yaw" so trees rotate on up axis
-                model_pose = [x, y, z, 0, 0, np.random.random_sample()]
-                model = create_tree_sdf(
-                    "model://oak_tree/meshes/oak_tree.dae",
-                    [
-                        "model://oak_tree/materials/scripts/",
-                        "model://oak_tree/materials/textures/",
-                    ],
-                    f"Tree_{i}",
-                    model_pose,
-                    ["OakTree/Branch", "OakTree/Bark"],
-                    [0.4, 0.4, 0.4],
+            return ground_model, [ground_file]
+
+        # tiles keep their edges, so neighbouring tiles still line up once simplified
+        lock_edges = self.model.get_tile() is not None
+        max_error = self.get_max_error()
+        visual_mesh = ground_mesh
+        if max_error > 0:
+            with span("simplify", max_error=max_error):
+                visual_mesh = simplify_ground_mesh(ground_mesh, max_error, lock_edges)
+        # mesh mush be exported first so the path exists
+        ground_file = export_mesh_file(visual_mesh, model_path, self.get_mesh_format())
+        ground_files = [ground_file]
+        collision_uri = None
+        collision_max_error = self.get_collision_max_error()
+        # a collision mesh finer than the visual one isn't worth writing, so the visual mesh is
+        # used for collisions too
+        if collision_max_error > max_error:
+            with span("simplify", max_error=collision_max_error):
+                collision_mesh = simplify_ground_mesh(
+                    ground_mesh, collision_max_error, lock_edges
                 )
-            world.children["model"].append(model)
-        grass = self.model.get_grass()
-        for i, grass_mesh in enumerate(grass):
-            x, y, z = grass_mesh.metadata["displacement"]
-            model_pose = [x, y, z, np.random.random_sample(), 0, 0]
-            model = create_grass_sdf(
-                "model://grass_blade/meshes/model.dae",
-                f"Grass_{i}",
-                model_pose,
-                "Gazebo/Green",
-                [0.1, 0.1, 0.1],
+            collision_file = export_mesh_file(
+                collision_mesh, model_path, self.get_mesh_format(), "collision"
             )
-            world.children["model"].append(model)
-        sdf = create_sdf_element("sdf")
-        sdf.children["world"] = world
-        world_name = custom_name or f"{noise_type}_generated_world.world"
-        world_name = world_name if ".world" in world_name else f"{world_name}.world"
-        sdf.export_xml(f"./worlds/{world_name}")
-        print("world exported")
+            collision_uri = f"model://{model_folder}/{collision_file}"
+            ground_files.append(collision_file)
+        # create a link to the exported mesh
+        ground_mesh_uri = f"model://{model_folder}/{ground_file}"
+        with span("sdf_build"):
+            ground_model = create_ground_sdf(
+                ground_mesh_uri,
+                "ground_mesh",
+                [0, 0, 0, 0, 0, 0],
+                "Gazebo/Grass",
+                [1, 1, 1],
+                collision_uri,
+            )
+        return ground_model, ground_files
 
     def preview_mesh(self):
         self.model.preview_mesh()
@@ -0,0 +1,144 @@
+"""
+Generate worlds from yml presets without the GUI (no display or tkinter needed), e.g.
+
+    python generate_worlds.py assets/setting-presets/Default.yml --seeds 0-99
+
+Each preset is exported once per seed, as `<preset>_<seed>.world` in the world dir and a
+`<preset>_<seed>` ground mesh model in ~/.gazebo/models.
+"""
+
+import argparse
+import os
+from pathlib import Path
+from controllers.terrain_generator import (
+    TerrainGeneratorController,
+    read_generator_settings,
+)
+from models.terrain_generator import TerrainGeneratorModel
+from util.parallel_generation import generate_worlds_parallel
+
+
+def parse_seeds(value):
+    """
+    Parses a list of seeds and seed ranges, e.g. "0-3,10" -> [0, 1, 2, 3, 10]
+    """
+    seeds = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        if end:
+            seeds.extend(range(int(start), int(end) + 1))
+        else:
+            seeds.append(int(start))
+    if not seeds:
+        raise argparse.ArgumentTypeError(f"no seeds in '{value}'")
+    return seeds
+
+
+def generate_worlds(
+    preset_paths,
+    seeds,
+    world_dir="./worlds",
+    workers=1,
+    force=False,
+    tile_workers=None,
+):
+    """
+    Exports a world for every preset and seed, yielding each world name once it's written.
+    With more than one worker, worlds are generated in parallel and may finish in any order.
+    Worlds that were already exported with the same settings are skipped unless `force` is set.
+    `tile_workers` limits the processes each tiled world uses, but with more than one worker
+    every world's tiles are generated in its own worker
+    """
+    model = TerrainGeneratorModel()
+    controller = TerrainGeneratorController(model)
+    controller.export_collision_objects()
+    if workers > 1:
+        jobs = []
+        for preset_path in preset_paths:
+            preset = read_generator_settings(preset_path)
+            for seed in seeds:
+                world_name = f"{Path(preset_path).stem}_{seed}"
+                jobs.append(({**preset, "name": world_name}, seed))
+        for world_name, _ in generate_worlds_parallel(
+            jobs, world_dir, workers, force=force
+        ):
+            yield world_name
+        return
+
+    for preset_path in preset_paths:
+        preset = read_generator_settings(preset_path)
+        for seed in seeds:
+            controller.apply_settings({**preset, "seed": seed})
+            world_name = f"{Path(preset_path).stem}_{seed}"
+            controller.export_world(
+                world_name, world_dir=world_dir, force=force, max_workers=tile_workers
+            )
+            yield world_name
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate gazebo worlds from yml presets without the GUI"
+    )
+    parser.add_argument("presets", nargs="+", help="yml preset files")
+    parser.add_argument(
+        "--seeds",
+        type=parse_seeds,
+        default=[0],
+        help='seeds and seed ranges to generate, e.g. "0-99" or "1,5,10-20" (default: 0)',
+    )
+    parser.add_argument(
+        "--world-dir", default="./worlds", help="where to write .world files"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worlds to generate in parallel, one process each (default: 1)",
+    )
+    parser.add_argument(
+        "--tile-workers",
+        type=int,
+        help="number of processes to generate the tiles of a world in (default: one per core)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="export every world, even ones that are already up to date",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print how long each stage of every export took",
+    )
+    parser.add_argument(
+        "--trace-dir",
+        help="write each export as a chrome trace (chrome://tracing) to this dir",
+    )
+    args = parser.parse_args()
+    # set in the environment, so worker processes pick them up too
+    if args.profile:
+        os.environ["TERRAIN_PROFILE"] = "1"
+    if args.trace_dir:
+        os.environ["TERRAIN_TRACE_DIR"] = args.trace_dir
+
+    total = len(args.presets) * len(args.seeds)
+    for i, world_name in enumerate(
+        generate_worlds(
+            args.presets,
+            args.seeds,
+            args.world_dir,
+            args.workers,
+            args.force,
+            args.tile_workers,
+        ),
+        start=1,
+    ):
+        print(f"[{i}/{total}] {world_name}")
+
+
+if __name__ == "__main__":
+    main()
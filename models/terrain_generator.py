@@ -2,11 +2,22 @@
 # import os
 from pcg_gazebo.simulation import World
 from util.noise_generators import custom_noise
-from util.generate_mesh import create_grass, create_ground_mesh, create_obstacles
+from util.generate_mesh import (
+    create_ground_mesh,
+    decimate_ground_mesh,
+    place_grass,
+    place_rocks,
+    place_trees,
+)
+from util.heightmap_cache import canonical_noise_options, heightmap_cache, heightmap_key
+from util.instance_table import InstanceTable
+from util.instrumentation import span
 import numpy as np
-from trimesh import scene
 from util.terrain_defaults import settings
 
+# the ground is resampled to at most this many points across for the 3D preview
+PREVIEW_MESH_RESOLUTION = 257
+
 
 class TerrainGeneratorModel:
     """Creates window object for terrain generator"""
@@ -19,22 +30,40 @@ class TerrainGeneratorModel:
         self._height_multiplier = settings["height_multiplier"]
         self._resolution = settings["resolution"]
         self._scale = settings["scale"]
+        self._seed = settings["seed"]
+        # every random draw for a world comes from this, so the same seed gives the same world.
+        # It's recreated from the seed each time the mesh is generated
+        self._rng = np.random.default_rng(self._seed)
         self._max_angle = settings["max_angle"]
+        self._local_clamp = settings["local_clamp"]
+        self._tiles = settings["tiles"]
         self._tree_density = settings["tree_density"]
         self._rock_density = settings["rock_density"]
         self._total_obstacles = settings["total_obstacles"]
         self._mesh_rgba = settings["mesh_rgba"]
-        self._obstacle_items = settings["obstacle_items"]
+        self._mesh_format = settings["mesh_format"]
+        self._ground_type = settings["ground_type"]
+        self._max_error = settings["max_error"]
+        self._collision_max_error = settings["collision_max_error"]
         self._total_grass = settings["total_grass"]
-        self._grass_items = settings["grass_items"]
+        self._instance_mode = settings["instance_mode"]
         self._noise_type = settings["noise_type"]
-        self._noise_options = settings["noise_options"]
+        # copied so changing an option never changes the defaults
+        self._noise_options = dict(settings["noise_options"])
+        # the (row, column) of the tile being generated when the world is split into tiles,
+        # and the noise offset every tile shares so their edges line up
+        self._tile = None
+        self._noise_offset = None
+        # every rock, tree and grass blade, stored as transforms of one shared mesh per kind
+        self._instances = InstanceTable()
         # Numpy procedural array
         self._procedural_array = None
         self.generate_procedural_array()
 
         # Mesh
         self._mesh = None
+        # the settings the mesh was generated with, so it's only regenerated when they change
+        self._mesh_key = None
         self._generate_mesh()
         self._world = World("world1")
 
@@ -67,9 +96,41 @@ class TerrainGeneratorModel:
     def set_scale(self, value):
         self._scale = int(value)
 
+    def set_seed(self, value):
+        self._seed = int(value)
+
     def set_max_angle(self, value):
         self._max_angle = int(value)
 
+    def set_local_clamp(self, value):
+        self._local_clamp = bool(value)
+
+    def set_tiles(self, value):
+        self._tiles = max(int(value), 1)
+
+    def set_mesh_format(self, value):
+        self._mesh_format = str(value).lower()
+
+    def set_ground_type(self, value):
+        self._ground_type = str(value).lower()
+
+    def set_instance_mode(self, value):
+        self._instance_mode = str(value).lower()
+
+    def set_max_error(self, value):
+        self._max_error = max(float(value), 0)
+
+    def set_collision_max_error(self, value):
+        self._collision_max_error = max(float(value), 0)
+
+    def set_tile(self, tile=None, noise_offset=None):
+        """
+        Generate one tile of a larger world, where `tile` is its (row, column), or the whole
+        world when `tile` is None
+        """
+        self._tile = None if tile is None else tuple(int(i) for i in tile)
+        self._noise_offset = noise_offset
+
     def set_tree_density(self, value):
         self._tree_density = float(value)
 
@@ -113,9 +174,39 @@ class TerrainGeneratorModel:
     def get_world(self):
         return self._world
 
+    def get_seed(self):
+        return self._seed
+
+    def get_rng(self):
+        return self._rng
+
     def get_max_angle(self):
         return self._max_angle
 
+    def get_local_clamp(self):
+        return self._local_clamp
+
+    def get_tiles(self):
+        return self._tiles
+
+    def get_mesh_format(self):
+        return self._mesh_format
+
+    def get_ground_type(self):
+        return self._ground_type
+
+    def get_instance_mode(self):
+        return self._instance_mode
+
+    def get_max_error(self):
+        return self._max_error
+
+    def get_collision_max_error(self):
+        return self._collision_max_error
+
+    def get_tile(self):
+        return self._tile
+
     def get_tree_density(self):
         return self._tree_density
 
@@ -125,19 +216,16 @@ class TerrainGeneratorModel:
     def get_total_obstacles(self):
         return self._total_obstacles
 
-    def get_obstacles(self):
-        return self._obstacle_items
+    def get_instances(self):
+        return self._instances
 
     def get_total_grass(self):
         return self._total_grass
 
-    def get_grass(self):
-        return self._grass_items
-
     def get_mesh_color(self, normalise=False):
         if normalise:
             # just normalise the red, green and blue channels, not the alpha
-            rgb = self._mesh_rgba[:3] / 255
+            rgb = np.asarray(self._mesh_rgba[:3]) / 255
             return np.append(rgb, self._mesh_rgba[-1])
         return self._mesh_rgba
 
@@ -145,23 +233,106 @@ class TerrainGeneratorModel:
         return self._procedural_array
 
     def preview_mesh(self):
-        # reset the mesh
-        self.update_mesh()
+        # only regenerate the mesh if a setting changed since it was generated
+        if self._mesh is None or self._mesh_key != self.get_mesh_key():
+            self.update_mesh()
         if self._mesh:
-            world = scene.scene.Scene(self._mesh)
-            for geo in self._obstacle_items:
-                world.add_geometry(geo)
-            for geo in self._grass_items:
-                world.add_geometry(geo)
+            ground_mesh = decimate_ground_mesh(self._mesh, PREVIEW_MESH_RESOLUTION)
+            ground_mesh.visual.face_colors = self.get_mesh_color(normalise=True)
+            world = self._instances.to_merged_scene(ground_mesh)
             world.show()
 
     def generate_procedural_array(self):
-        noise = custom_noise(
-            resolution=self._resolution,
-            noise_type=self._noise_type,
-            **self._noise_options
+        params = self.get_heightmap_params()
+        with span("noise", resolution=params["resolution"]):
+            self._procedural_array = self.create_procedural_array(params)
+
+    def get_heightmap_params(self):
+        """
+        A snapshot of every setting the procedural array depends on. It's a copy, so it can
+        be handed to another thread while the settings keep changing
+        """
+        return {
+            "resolution": self._resolution,
+            "noise_type": self._noise_type,
+            "noise_options": dict(self._noise_options),
+            "height_multiplier": self._height_multiplier,
+            "seed": self._seed,
+            "start": self.get_noise_start(),
+            "offset": self._noise_offset,
+        }
+
+    def get_preview_params(self, size):
+        """
+        The heightmap params for a `size` x `size` preview of the same terrain, sampled
+        straight from the noise so the full resolution heightmap is never generated.
+        Heightmaps smaller than `size` are kept at their own resolution
+        """
+        params = self.get_heightmap_params()
+        if self._resolution > size:
+            params["resolution"] = size
+            params["step"] = (self._resolution - 1) / (size - 1)
+        return params
+
+    def get_mesh_key(self):
+        """Every setting the mesh and its instances depend on"""
+        params = self.get_heightmap_params()
+        return (
+            heightmap_key(
+                params["noise_type"],
+                params["resolution"],
+                params["noise_options"],
+                params["seed"],
+                params["start"],
+                params["offset"],
+            ),
+            params["height_multiplier"],
+            self._width,
+            self._depth,
+            self._max_angle,
+            self._local_clamp,
+            self._rock_density,
+            self._tree_density,
+            self._total_obstacles,
+            self._total_grass,
+            self._tile,
+        )
+
+    def get_noise_start(self):
+        """Where this tile's noise starts, so it continues seamlessly from its neighbours"""
+        if self._tile is None:
+            return (0, 0)
+        row, col = self._tile
+        return (row * (self._resolution - 1), col * (self._resolution - 1))
+
+    @staticmethod
+    def create_procedural_array(params):
+        # the height multiplier isn't part of the key, so changing it never regenerates noise
+        key = heightmap_key(
+            params["noise_type"],
+            params["resolution"],
+            params["noise_options"],
+            params["seed"],
+            params.get("start", (0, 0)),
+            params.get("offset"),
+            params.get("step", 1),
         )
-        self._procedural_array = noise * self._height_multiplier
+        noise = heightmap_cache.get_or_create(
+            key,
+            lambda: custom_noise(
+                resolution=params["resolution"],
+                noise_type=params["noise_type"],
+                seed=params["seed"],
+                start=params.get("start", (0, 0)),
+                offset=params.get("offset"),
+                step=params.get("step", 1),
+                **canonical_noise_options(params["noise_options"])
+            ),
+        )
+        return noise * params["height_multiplier"]
+
+    def set_procedural_array(self, array):
+        self._procedural_array = array
 
     def get_obstacle_count(self):
         """
@@ -190,18 +361,34 @@ class TerrainGeneratorModel:
             width=self._width,
             depth=self._depth,
             max_angle=self._max_angle,
+            local_clamp=self._local_clamp,
         )
         self._mesh = mesh
-        if self._total_obstacles > 0:
-            rock_count, tree_count = self.get_obstacle_count()
-            # center displacement
-            x_displacement = [-self._width // 2, self._width // 2]
-            y_displacement = [-self._depth // 2, self._depth // 2]
-            self._obstacle_items = create_obstacles(
-                rock_count, tree_count, x_displacement, y_displacement, mesh
+        self._mesh_key = self.get_mesh_key()
+        # tiles are seeded by their position too, so each one places its obstacles differently
+        self._rng = np.random.default_rng(
+            self._seed if self._tile is None else [self._seed, *self._tile]
+        )
+        # every kind is replaced, even with a count of 0, so no earlier instances are kept
+        rock_count, tree_count = self.get_obstacle_count()
+        # center displacement
+        x_displacement = [-self._width // 2, self._width // 2]
+        y_displacement = [-self._depth // 2, self._depth // 2]
+        rng = self._rng
+        with span("placement", obstacles=self._total_obstacles):
+            self._instances.set_instances(
+                "rock",
+                place_rocks(rock_count, x_displacement, y_displacement, mesh, rng),
+            )
+            self._instances.set_instances(
+                "tree",
+                place_trees(tree_count, x_displacement, y_displacement, mesh, rng),
             )
-            self._grass_items = create_grass(
-                self._total_grass, x_displacement, y_displacement, mesh
+            self._instances.set_instances(
+                "grass",
+                place_grass(
+                    self._total_grass, x_displacement, y_displacement, mesh, rng
+                ),
             )
 
     # TODO: implement custom paths
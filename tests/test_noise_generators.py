@@ -0,0 +1,38 @@
+import numpy as np
+import pyfastnoisesimd as fns
+import pytest
+from util.noise_generators import SIMD_FLOATS, custom_noise
+
+NOISE_TYPES = ["Perlin", "SimplexFractal", "Cellular"]
+
+
+def get_volume_slice(resolution, noise_type, seed, depth=None):
+    """The heightmap custom_noise used to generate, the z=1 slice of a volume"""
+    noise = fns.Noise(seed)
+    noise.frequency = 0.1
+    noise.noiseType = fns.NoiseType[noise_type]
+    noise.fractal.fractalType = fns.FractalType["FBM"]
+    noise.fractal.octaves = 2
+    noise.fractal.gain = 0.5
+    noise.fractal.lacunarity = 2
+    array = noise.genAsGrid([resolution, resolution, depth or resolution])[:, :, 1]
+    return array + abs(array.min())
+
+
+@pytest.mark.parametrize("noise_type", NOISE_TYPES)
+@pytest.mark.parametrize("resolution", [16, 32, 48, 64, 128])
+def test_matches_volume_slice(resolution, noise_type):
+    expected = get_volume_slice(resolution, noise_type, seed=3)
+    np.testing.assert_array_equal(
+        custom_noise(resolution, noise_type, seed=3), expected
+    )
+
+
+@pytest.mark.parametrize("noise_type", NOISE_TYPES)
+@pytest.mark.parametrize("resolution", [2, 50, 129, 257, 300, 513])
+def test_any_resolution(resolution, noise_type):
+    # genAsGrid rejects volumes of these sizes, but the slice doesn't depend on the depth
+    expected = get_volume_slice(resolution, noise_type, seed=3, depth=SIMD_FLOATS)
+    np.testing.assert_array_equal(
+        custom_noise(resolution, noise_type, seed=3), expected
+    )
@@ -3,3 +3,42 @@ import numpy as np
 def normalise_array(array):
     min = np.min(array)
     return (array - min) / (np.max(array) - min)
+
+
+def normalise_to_uint8(array, in_place=False):
+    """
+    Scales an array to 0-255 as uint8, e.g. for a grayscale image
+    `in_place` -- scale `array` itself rather than a float32 copy, so no temporaries are
+    allocated. It must be a writable float array, which is left scaled (default=False)
+    """
+    scaled = array if in_place else np.array(array, dtype=np.float32)
+    low, high = scaled.min(), scaled.max()
+    scaled -= low
+    if high > low:
+        scaled *= 255 / (high - low)
+    return scaled.astype(np.uint8)
+
+
+def get_heightmap_size(resolution):
+    """
+    Gazebo heightmaps and `simplify_ground_mesh` need grids 2^n+1 points square, so use the
+    smallest one that fits
+    """
+    return 2 ** int(np.ceil(np.log2(max(resolution - 1, 1)))) + 1
+
+
+def resample_heights(heights, size):
+    """
+    Bilinearly resample a square grid of heights to `size` x `size`, keeping the corners
+    (and so the terrain's extent) in place
+    """
+    resolution = heights.shape[0]
+    if resolution == size:
+        return heights
+    # where each new row/column falls between the old ones
+    coords = np.linspace(0, resolution - 1, size)
+    low = np.minimum(coords.astype(np.intp), resolution - 2)
+    t = coords - low
+    # interpolate along rows, then along columns
+    rows = heights[low] * (1 - t)[:, None] + heights[low + 1] * t[:, None]
+    return rows[:, low] * (1 - t) + rows[:, low + 1] * t
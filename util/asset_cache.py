@@ -0,0 +1,171 @@
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import numpy as np
+import trimesh
+from PIL import Image
+from trimesh import visual
+from trimesh.exchange import load
+
+# Parsed assets for this process, keyed by (path, mtime). Editing an asset changes its mtime,
+# so the stale entry is simply never looked up again.
+_cache = {}
+# when set, parsed meshes are also stored here as plain arrays, so later processes can skip the
+# COLLADA parsing
+_disk_cache_dir = os.environ.get("TERRAIN_ASSET_CACHE_DIR")
+
+
+def set_disk_cache_dir(path):
+    """
+    Enable (or disable with `None`) storing parsed meshes on disk for later process starts
+    """
+    global _disk_cache_dir
+    _disk_cache_dir = path
+
+
+def get_disk_cache_dir():
+    return _disk_cache_dir
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def get_cache_key(path):
+    path = Path(path).resolve()
+    return (str(path), path.stat().st_mtime_ns)
+
+
+def get_disk_cache_path(key):
+    # another trimesh version may parse the same file differently
+    digest = hashlib.sha1(repr((key, trimesh.__version__)).encode()).hexdigest()
+    return Path(_disk_cache_dir, f"{Path(key[0]).stem}-{digest}.npz")
+
+
+# every setting of a PBR material (the kind COLLADA files are loaded with), so a cached mesh
+# looks exactly like a parsed one
+PBR_FIELDS = [
+    "name",
+    "emissiveFactor",
+    "baseColorFactor",
+    "metallicFactor",
+    "roughnessFactor",
+    "doubleSided",
+    "alphaMode",
+    "alphaCutoff",
+]
+PBR_TEXTURES = [
+    "emissiveTexture",
+    "normalTexture",
+    "occlusionTexture",
+    "baseColorTexture",
+    "metallicRoughnessTexture",
+]
+
+
+def save_mesh_arrays(mesh, path):
+    """
+    Stores the geometry, UVs and PBR material of a mesh as plain arrays, with textures as PNG
+    bytes, so unlike a pickle, loading it never depends on trimesh's classes or runs code from
+    the cache directory
+
+    @returns False if the mesh has anything else that can't be stored, so it isn't cached
+    """
+    material = getattr(mesh.visual, "material", None)
+    if not isinstance(mesh.visual, visual.TextureVisuals) or not isinstance(
+        material, visual.material.PBRMaterial
+    ):
+        return False
+    arrays = {
+        "vertices": mesh.vertices,
+        "faces": mesh.faces,
+        "vertex_normals": mesh.vertex_normals,
+        "metadata": np.array(json.dumps(mesh.metadata, default=str)),
+    }
+    if mesh.visual.uv is not None:
+        arrays["uv"] = mesh.visual.uv
+    for field in PBR_FIELDS:
+        value = getattr(material, field)
+        if value is not None:
+            arrays[f"material_{field}"] = np.asarray(value)
+    for field in PBR_TEXTURES:
+        image = getattr(material, field)
+        if image is not None:
+            png = io.BytesIO()
+            image.save(png, format="PNG")
+            arrays[f"texture_{field}"] = np.frombuffer(png.getvalue(), dtype=np.uint8)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temp file first, so other processes never read a partial file
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return True
+
+
+def load_mesh_arrays(path):
+    """The mesh stored by `save_mesh_arrays`"""
+    with np.load(path, allow_pickle=False) as arrays:
+        settings = {}
+        for field in PBR_FIELDS:
+            if f"material_{field}" in arrays:
+                value = arrays[f"material_{field}"]
+                # scalars and strings are stored as 0-d arrays
+                settings[field] = value.item() if value.ndim == 0 else value
+        for field in PBR_TEXTURES:
+            if f"texture_{field}" in arrays:
+                image = Image.open(io.BytesIO(arrays[f"texture_{field}"].tobytes()))
+                image.load()
+                settings[field] = image
+        return trimesh.Trimesh(
+            vertices=arrays["vertices"],
+            faces=arrays["faces"],
+            vertex_normals=arrays["vertex_normals"],
+            visual=visual.TextureVisuals(
+                uv=arrays["uv"] if "uv" in arrays else None,
+                material=visual.material.PBRMaterial(**settings),
+            ),
+            metadata=json.loads(str(arrays["metadata"])),
+            process=False,
+        )
+
+
+def load_mesh(path):
+    """
+    Loads a mesh file (e.g. COLLADA) as a single Trimesh, parsing each file at most once.
+
+    The returned mesh is shared, so it must not be modified. Use `mesh.copy()` first if needed.
+    """
+    key = get_cache_key(path)
+    if key in _cache:
+        return _cache[key]
+
+    mesh = None
+    disk_path = get_disk_cache_path(key) if _disk_cache_dir else None
+    if disk_path and disk_path.exists():
+        try:
+            mesh = load_mesh_arrays(disk_path)
+        except Exception:
+            # e.g. a truncated or foreign file, so parse the asset again and replace it
+            mesh = None
+    if mesh is None:
+        mesh = load.load(key[0], force="mesh")
+        if disk_path:
+            save_mesh_arrays(mesh, disk_path)
+
+    _cache[key] = mesh
+    return mesh
+
+
+def load_image(path):
+    """
+    Opens and decodes an image once. The returned image is shared, so it must not be modified.
+    """
+    key = get_cache_key(path)
+    if key not in _cache:
+        image = Image.open(key[0])
+        image.load()  # PIL is lazy, so force the decode now rather than on every use
+        _cache[key] = image
+    return _cache[key]
@@ -0,0 +1,89 @@
+import inspect
+import queue
+import threading
+
+
+class BackgroundWorker:
+    """
+    Runs jobs one at a time on a background thread, where only the latest job matters.
+
+    Submitting a job replaces any job that hasn't started yet, and the result of a job that
+    finishes after a newer one was submitted is dropped. Results and progress messages are
+    queued rather than called directly, so the UI thread can pick them up with `poll()`
+    (tkinter isn't thread safe, so they must not be handled on the worker thread).
+
+    A job can also be a generator, which hands `on_result` each value it yields, e.g. to
+    refine a result in steps. It's stopped between yields once a newer job is submitted.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = None
+        self._latest_id = 0
+        self._messages = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, job, on_result, on_progress=None):
+        """
+        Queue a job, cancelling any job that hasn't started yet
+
+        :param job callable: called as `job(report)` on the worker thread, where `report(text)`
+        can be used to post progress messages
+        :param on_result callable: called with the job's return value, or each value it
+        yields, during `poll()`
+        :param on_progress callable: called with each progress message during `poll()`
+        """
+        with self._condition:
+            self._latest_id += 1
+            self._pending = (self._latest_id, job, on_result, on_progress)
+            self._condition.notify()
+        return self._latest_id
+
+    def is_stale(self, job_id):
+        return job_id != self._latest_id
+
+    def poll(self):
+        """Handle every queued result and progress message. Call this from the UI thread"""
+        while True:
+            try:
+                job_id, callback, value = self._messages.get_nowait()
+            except queue.Empty:
+                return
+            if callback and not self.is_stale(job_id):
+                callback(value)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                job_id, job, on_result, on_progress = self._pending
+                self._pending = None
+
+            def report(text, job_id=job_id, on_progress=on_progress):
+                self._messages.put((job_id, on_progress, text))
+
+            try:
+                result = job(report)
+                if inspect.isgenerator(result):
+                    self._run_steps(job_id, result, on_result)
+                    continue
+            except Exception as exc:  # keep the worker alive for the next job
+                report(f"Error: {exc}")
+                continue
+            if not self.is_stale(job_id):
+                self._messages.put((job_id, on_result, result))
+
+    def _run_steps(self, job_id, steps, on_result):
+        """Posts each value `steps` yields, until it finishes or a newer job is submitted"""
+        try:
+            while not self.is_stale(job_id):
+                try:
+                    result = next(steps)
+                except StopIteration:
+                    return
+                if not self.is_stale(job_id):
+                    self._messages.put((job_id, on_result, result))
+        finally:
+            steps.close()
@@ -0,0 +1,78 @@
+import functools
+import hashlib
+import json
+from pathlib import Path
+
+# Bump this whenever the exported files change for the same settings, so old exports are redone
+EXPORT_VERSION = 1
+MANIFEST_NAME = "export_manifest.json"
+
+
+def get_assets_version(assets_dir="assets/meshes"):
+    """
+    A hash of every obstacle asset, so changing a mesh, texture or material invalidates exports.
+    The files are only read again once one is added, removed or modified.
+    """
+    assets_path = Path(Path.cwd(), assets_dir)
+    files = []
+    for path in sorted(p for p in assets_path.rglob("*") if p.is_file()):
+        stat = path.stat()
+        files.append(
+            (str(path.relative_to(assets_path)), stat.st_mtime_ns, stat.st_size)
+        )
+    return hash_assets(str(assets_path), tuple(files))
+
+
+@functools.lru_cache(maxsize=8)
+def hash_assets(assets_path, files):
+    """
+    :param files tuple: (relative path, mtime, size) of each asset, so editing one is a cache miss
+    """
+    digest = hashlib.sha256()
+    for relative_path, *_ in files:
+        digest.update(relative_path.encode())
+        digest.update(Path(assets_path, relative_path).read_bytes())
+    return digest.hexdigest()
+
+
+def get_export_hash(settings, model_folder, world_path):
+    """
+    Hashes everything an export depends on: the settings (including the seed), where it's
+    written to, the assets and the export code version
+
+    :param world_path Path: the world file. Resolved, so the same file always hashes the same
+    and a world exported to another directory is never taken for this one
+    """
+    payload = {
+        "settings": settings,
+        "model_folder": model_folder,
+        "world_path": str(Path(world_path).resolve()),
+        "assets": get_assets_version(),
+        "export_version": EXPORT_VERSION,
+    }
+    # sort_keys makes the json canonical, so equal settings always give the same hash
+    canonical = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def read_manifest(model_path):
+    try:
+        with open(Path(model_path, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_manifest(model_path, export_hash, files):
+    """Written after everything else, so a manifest only exists for a finished export"""
+    manifest = {"hash": export_hash, "files": [str(path) for path in files]}
+    with open(Path(model_path, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def is_export_current(model_path, export_hash):
+    """True if the export in `model_path` was made with the same hash and all its files exist"""
+    manifest = read_manifest(model_path)
+    if not manifest or manifest.get("hash") != export_hash:
+        return False
+    return all(Path(path).exists() for path in manifest.get("files", []))
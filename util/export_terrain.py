@@ -1,12 +1,58 @@
+import numpy as np
 from pcg_gazebo.parsers.sdf import Include
 from pcg_gazebo.parsers.sdf_config import Author, Model, SDF, Version
 from pathlib import Path
+from PIL import Image
+from util.array_helpers import get_heightmap_size, resample_heights
+from util.instrumentation import span
 
-from util.sdf_creator import create_model_sdf_elements, create_sdf_tree
+from util.sdf_creator import create_ground_mesh_sdf_elements, create_sdf_tree
 
+# The formats the ground mesh can be written as. Binary STL and GLB are much faster to write
+# and smaller than OBJ. Note gazebo classic can't load GLB (gz sim can), and DAE is the
+# format gazebo classic handles materials best with.
+MESH_FORMATS = ["obj", "stl", "glb", "dae"]
+# "heightmap" writes a 16 bit png that gazebo loads as <heightmap> geometry, which loads and
+# collides much faster than a large triangle mesh
+GROUND_TYPES = ["mesh", "heightmap"]
 
-def export_ground_mesh(mesh, mesh_name="ground_mesh1", color=(0.5, 0.5, 0.5, 1)):
-    model_name = "model.obj"
+
+def export_mesh_file(mesh, model_path, mesh_format="obj", name="model"):
+    """
+    Writes `mesh` to `model_path` as `<name>.<mesh_format>`
+
+    @returns the file name, e.g. "model.stl"
+    """
+    if mesh_format not in MESH_FORMATS:
+        raise ValueError(
+            f"Unknown mesh format '{mesh_format}', use one of {MESH_FORMATS}"
+        )
+    model_name = f"{name}.{mesh_format}"
+    # trimesh picks the exporter from the extension, and writes binary STL by default
+    with span("mesh_write", format=mesh_format):
+        mesh.export(f"{model_path}/{model_name}")
+    return model_name
+
+
+def export_heightmap_png(heights, path):
+    """
+    Writes a square grid of heights as a 16 bit grayscale png for a gazebo <heightmap>,
+    resampled to 2^n+1 pixels if needed
+
+    @returns the (min, max) height, as the png only stores heights relative to them
+    """
+    heights = resample_heights(heights, get_heightmap_size(heights.shape[0]))
+    z_min, z_max = float(heights.min()), float(heights.max())
+    z_range = (z_max - z_min) or 1
+    pixels = np.rint((heights - z_min) * (65535 / z_range)).astype(np.uint16)
+    # the first grid row is the lowest y, but gazebo puts the top image row at the highest y
+    Image.fromarray(pixels[::-1]).save(path)
+    return z_min, z_max
+
+
+def export_ground_mesh(
+    mesh, mesh_name="ground_mesh1", color=(0.5, 0.5, 0.5, 1), mesh_format="obj"
+):
     model_path = Path(Path.home(), ".gazebo", "models", mesh_name)
     model_path.mkdir(exist_ok=True)
 
@@ -14,16 +60,21 @@ def export_ground_mesh(mesh, mesh_name="ground_mesh1", color=(0.5, 0.5, 0.5, 1))
         return print("Erorr: Could not export as mesh does not exist")
 
     # mesh mush be exported first so the path exists
-    mesh.export(f"{model_path}/{model_name}")
+    model_name = export_mesh_file(mesh, model_path, mesh_format)
     # create a link to the exported mesh
     uri = f"model://{mesh_name}/{model_name}"
     rgba_color = color
-    sdf_elements = create_model_sdf_elements(uri, rgba_color)
+    sdf_elements = create_ground_mesh_sdf_elements(uri, rgba_color)
     model_sdf = create_sdf_tree(sdf_elements)
     if model_sdf:
         model_sdf.export_xml(f"{model_path}/model.sdf")
         print(f"Successfully exported {model_name} to {model_path}")
 
+    export_model_config(model_path)
+
+
+def export_model_config(model_path):
+    """Writes the model.config gazebo needs to find a model in `model_path`"""
     author = Author()
     author.email = "me@my.email"
     author.name = "My Name"
@@ -1,9 +1,10 @@
 import numpy as np
 from pathlib import Path
-from PIL import Image
 from trimesh import Trimesh, proximity, transformations, visual, smoothing
-from trimesh.exchange import load
-import copy
+import functools
+from util import asset_cache
+from util.array_helpers import get_heightmap_size, resample_heights
+from util.instrumentation import span
 import xatlas
 
 
@@ -53,80 +54,125 @@ def calc_run(x0, x1, y0, y1):
     return np.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
 
 
+def grid_edges(points, resolution):
+    """
+    Returns the `(rise, run)` of every mesh edge, for the right, down and diagonal neighbours
+    of each vertex in the `(resolution, resolution)` grid. These are the same edges that
+    `create_faces` triangulates.
+    """
+    grid = points.reshape(resolution, resolution, 3)
+    edges = []
+    for start, end in [
+        (grid[:, :-1], grid[:, 1:]),
+        (grid[:-1, :], grid[1:, :]),
+        (grid[:-1, :-1], grid[1:, 1:]),
+    ]:
+        rise = end[..., 2] - start[..., 2]
+        run = calc_run(start[..., 0], end[..., 0], start[..., 1], end[..., 1])
+        edges.append((rise.ravel(), run.ravel()))
+    rise = np.concatenate([edge[0] for edge in edges])
+    run = np.concatenate([edge[1] for edge in edges])
+    return rise, run
+
+
 def test_angle(points, angle_threshold, resolution):
     print("test angle------")
-    # Calculate the threshold in radians
-    angle_threshold_radians = np.radians(angle_threshold)
-    # max_height = 0
-
-    max_angle = float(0)
-
-    # Iterate through each point
-    for i in range(len(points) - 1 - resolution):
-        x0, y0, z0 = points[i]
-
-        # calculate slope between itself and 3 neighbouring points
-        for x, y, z in [
-            points[i + 1],
-            points[i + resolution],
-            points[i + resolution + 1],
-        ]:
-            run = calc_run(x0, x, y0, y)
-            rise = z - z0
-
-            # Calculate the angle of the point in radians
-            point_angle = np.arctan(abs(rise) / abs(run))
-
-            # Check if the point and neighbouring point angle is within the threshold
-            if abs(point_angle) > angle_threshold_radians:
-                angle = np.degrees(point_angle)
-                if angle > max_angle:
-                    max_angle = angle
-                    max_angle_z = abs(run * np.tan(angle_threshold_radians))
-                    print(
-                        f"max_angle_z={np.round(max_angle_z, 4)}"
-                        + f" rise={np.round(abs(rise), 4)}"
-                        + f" max_angle={np.round(angle, 4)}"
-                        + f" is_rise_greater={abs(rise) > max_angle_z}"
-                        + f" x0={np.round(x0, 4)} y0={np.round(y0, 4)} z0={np.round(z0, 4)}"
-                        + f" x={np.round(x, 4)} y={np.round(y, 4)} z={np.round(z, 4)}"
-                        + f" scale_factor={np.round(max_angle_z + abs(z0), 4)} / {np.round(abs(rise) + abs(z0), 4)}"
-                    )
+    rise, run = grid_edges(points, resolution)
+    angles = np.degrees(np.arctan(np.abs(rise) / run))
+    steepest = int(np.argmax(angles))
+    max_angle = float(angles[steepest])
+    if max_angle > angle_threshold:
+        max_angle_z = abs(run[steepest] * np.tan(np.radians(angle_threshold)))
+        print(
+            f"max_angle_z={np.round(max_angle_z, 4)}"
+            + f" rise={np.round(abs(rise[steepest]), 4)}"
+            + f" max_angle={np.round(max_angle, 4)}"
+            + f" is_rise_greater={abs(rise[steepest]) > max_angle_z}"
+            + f" scale_factor={np.round(max_angle_z / abs(rise[steepest]), 4)}"
+            + f" steep_edges={np.count_nonzero(angles > angle_threshold)}"
+        )
 
     print("max angle:")
     print(max_angle)
 
 
-def clamp_angle(points, angle_threshold, resolution):
-    # Calculate the threshold in radians
-    angle_threshold_radians = np.radians(angle_threshold)
+def limit_rise_along_axis(heights, max_rise, axis):
+    """
+    Lowers `heights` so that neighbouring values along `axis` never differ by more than `max_rise`.
+    Equivalent to `z'[k] = min_j(z[j] + |k - j| * max_rise)`, done with a forward and backward
+    running minimum instead of a python loop.
+    """
+    shape = [1, 1]
+    shape[axis] = -1
+    offsets = (np.arange(heights.shape[axis]) * max_rise).reshape(shape)
+    forward = np.minimum.accumulate(heights - offsets, axis=axis) + offsets
+    flipped = np.flip(heights, axis=axis)
+    backward = np.minimum.accumulate(flipped - offsets, axis=axis) + offsets
+    return np.minimum(forward, np.flip(backward, axis=axis))
+
+
+def limit_rise_along_diagonal(heights, max_rise):
+    """
+    Like `limit_rise_along_axis`, but between `heights[i, j]` and `heights[i + 1, j + 1]`.
+    Each diagonal is skewed into a column of its own, padded with inf, so the running minimum
+    covers a whole diagonal at once
+    """
+    rows, columns = heights.shape
+    row_index = np.arange(rows)[:, None]
+    skewed_index = np.arange(columns)[None, :] - row_index + rows - 1
+    skewed = np.full((rows, rows + columns - 1), np.inf)
+    skewed[row_index, skewed_index] = heights
+    return limit_rise_along_axis(skewed, max_rise, axis=0)[row_index, skewed_index]
 
-    max_angle = float(0)
-    scale_factor = 1
 
-    # Iterate through each point
-    for i in range(len(points) - 1 - resolution):
-        x0, y0, z0 = points[i]
-
-        # calculate slope between itself and 3 neighbouring points
-        for x, y, z in [
-            points[i + 1],
-            points[i + resolution],
-            points[i + resolution + 1],
-        ]:
-            run = calc_run(x0, x, y0, y)
-            rise = z - z0
-
-            # Calculate the angle of the point in radians
-            point_angle = np.arctan(abs(rise) / abs(run))
-
-            # Check if the point and neighbouring point angle is within the threshold
-            if abs(point_angle) > angle_threshold_radians:
-                angle = np.degrees(point_angle)
-                if angle > max_angle:
-                    max_angle = angle
-                    max_angle_z = abs(run * np.tan(angle_threshold_radians))
-                    scale_factor = max_angle_z / abs(rise)
+def clamp_angle_locally(points, angle_threshold, resolution):
+    """
+    Limits the slope of every edge to `angle_threshold` by only cutting down the parts of the
+    terrain that are too steep, rather than flattening the whole terrain by one scale factor.
+    """
+    grid = points.reshape(resolution, resolution, 3)
+    slope = np.tan(np.radians(angle_threshold))
+    # create_vertices makes a regular grid, so every edge in a direction has the same run
+    run_x = calc_run(grid[0, 0, 0], grid[0, 1, 0], grid[0, 0, 1], grid[0, 1, 1])
+    run_y = calc_run(grid[0, 0, 0], grid[1, 0, 0], grid[0, 0, 1], grid[1, 0, 1])
+    run_xy = calc_run(grid[0, 0, 0], grid[1, 1, 0], grid[0, 0, 1], grid[1, 1, 1])
+
+    heights = grid[..., 2].copy()
+    # each pass fully applies every direction, so another pass is only needed where the
+    # steepest path to a vertex turns. This settles in a few passes, the bound is a safeguard
+    for _ in range(resolution):
+        previous = heights
+        heights = limit_rise_along_axis(heights, run_x * slope, axis=1)
+        heights = limit_rise_along_axis(heights, run_y * slope, axis=0)
+        heights = limit_rise_along_diagonal(heights, run_xy * slope)
+        # adding and removing the offsets can still move a settled height by rounding error
+        if np.allclose(heights, previous, rtol=0, atol=1e-9):
+            break
+
+    clamped = points.copy()
+    clamped[:, 2] = heights.ravel()
+    return clamped
+
+
+def clamp_angle(points, angle_threshold, resolution, local=False):
+    """
+    Limits the max angle between any two neighbouring points to `angle_threshold` (degrees)
+
+    `local` -- when false the whole terrain is scaled down by one factor so the steepest edge
+    meets the threshold. When true only the steep regions are cut down (default=False)
+    """
+    if resolution < 2:
+        return points
+    if local:
+        return clamp_angle_locally(points, angle_threshold, resolution)
+
+    rise, run = grid_edges(points, resolution)
+    # the steepest edge is the one with the largest rise over run, as arctan is monotonic
+    max_slope = np.max(np.abs(rise) / run)
+    threshold_slope = np.tan(np.radians(angle_threshold))
+    scale_factor = 1
+    if max_slope > threshold_slope:
+        scale_factor = threshold_slope / max_slope
 
     return points * [1, 1, scale_factor]
 
@@ -154,31 +200,40 @@ def create_faces(resolution=48):
     """
     Creates faces
     `resolution` -- the resolution needed for the mesh
+
+    Returns a read-only `(2 * (resolution - 1) ** 2, 3)` index array. The array is cached
+    per resolution so repeated previews at the same resolution share one index buffer.
     """
-    # Create the list of faces
-    faces = []
-    # The -1 is used here because we want to create quads (4 vertices per face),
-    # and the last row and column of vertices will not be used for creating faces
-    for i in range(resolution - 1):
-        # Again, the -1 is used because we want to create quads.
-        for j in range(resolution - 1):
-            # This calculates the index of the first vertex of the current quad
-            # using the formula i * resolution + j.
-            # Since each row contains resolution vertices,
-            # we multiply i by resolution to get the start index of the current row,
-            # and then add j to get the index of the current vertex within that row.
-            p1 = i * resolution + j
-            p2 = i * resolution + j + 1
-            p3 = (i + 1) * resolution + j + 1
-            p4 = (i + 1) * resolution + j
-            # This creates two new faces using the four vertices we calculated
-            # aka triangulation
-            faces.extend([[p1, p2, p3], [p1, p3, p4]])
+    return _create_faces(int(resolution))
 
+
+@functools.lru_cache(maxsize=8)
+def _create_faces(resolution):
+    # int32 is plenty for any practical grid and halves the size of the index buffer
+    dtype = np.int32 if resolution**2 < np.iinfo(np.int32).max else np.int64
+    # The -1 is used here because we want to create quads (4 vertices per face),
+    # and the last row and column of vertices will not be used for creating faces.
+    # The index of the first vertex of each quad is i * resolution + j,
+    # since each row contains resolution vertices
+    rows = np.arange(resolution - 1, dtype=dtype) * resolution
+    cols = np.arange(resolution - 1, dtype=dtype)
+    p1 = (rows[:, None] + cols[None, :]).ravel()
+    p2 = p1 + 1
+    p3 = p1 + resolution + 1
+    p4 = p1 + resolution
+    # Two triangles per quad (aka triangulation), interleaved so the order matches
+    # [[p1, p2, p3], [p1, p3, p4], ...] for each quad in row-major order
+    faces = np.empty((len(p1), 2, 3), dtype=dtype)
+    faces[:, 0] = np.column_stack((p1, p2, p3))
+    faces[:, 1] = np.column_stack((p1, p3, p4))
+    faces = faces.reshape(-1, 3)
+    faces.flags.writeable = False  # shared between meshes, so it must never be mutated
     return faces
 
 
-def create_ground_mesh(noise_map, resolution=48, width=10, depth=10, max_angle=90):
+def create_ground_mesh(
+    noise_map, resolution=48, width=10, depth=10, max_angle=90, local_clamp=False
+):
     """
     Create a trimesh from the vertices and faces
     `noise_map` -- a 2D array of equal dimensions e.g. if rows=10 then columns=10
@@ -187,81 +242,224 @@ def create_ground_mesh(noise_map, resolution=48, width=10, depth=10, max_angle=9
     `depth` -- depth of mesh (default=10)
     `obstacle_count` -- count of obstacles on resulting mesh (default=0)
     `max_angle` -- the max angle between any two points in degrees (default=0)
+    `local_clamp` -- only cut down steep regions instead of flattening the whole terrain to meet
+    `max_angle` (default=False)
     """
-    vertices = create_vertices(noise_map, resolution, width, depth)
+    with span("vertices"):
+        vertices = create_vertices(noise_map, resolution, width, depth)
     if max_angle < 90:
-        vertices = clamp_angle(vertices, max_angle, resolution)
-    faces = create_faces(resolution)
-    terrain_mesh = Trimesh(vertices=vertices, faces=faces, visual=visual.TextureVisuals())
+        with span("clamp", local=local_clamp):
+            vertices = clamp_angle(vertices, max_angle, resolution, local=local_clamp)
+    with span("faces"):
+        faces = create_faces(resolution)
+        terrain_mesh = Trimesh(
+            vertices=vertices, faces=faces, visual=visual.TextureVisuals()
+        )
     # Ensure the mesh has a visual
     # if not hasattr(terrain_mesh, 'visual') or terrain_mesh.visual is None:
-    #     terrain_mesh.visual = 
-    unwrap_mesh(terrain_mesh)
+    #     terrain_mesh.visual =
+    with span("unwrap"):
+        unwrap_mesh(terrain_mesh)
+    # keep the height grid so heights can be looked up without searching every face
+    terrain_mesh.metadata["height_grid"] = vertices[:, 2].reshape(
+        resolution, resolution
+    )
+    terrain_mesh.metadata["size"] = (width, depth)
     return terrain_mesh
 
 
-def displace_mesh(mesh, displacement, scale, rotation_axis, rotation_angle):
-    rotate_mesh(mesh, rotation_angle, rotation_axis)
-    scale_mesh(mesh, scale)
-    translate_mesh(mesh, displacement)
+def split_rtin_triangles(triangles):
+    """
+    Splits each right triangle `(a, b, c)` at the midpoint `m` of its hypotenuse `a-b`,
+    into `(c, a, m)` and `(b, c, m)`. `triangles` is an (N, 3, 2) array of grid (x, y) points
+    """
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    m = (a + b) // 2
+    return np.concatenate([np.stack([c, a, m], 1), np.stack([b, c, m], 1)])
 
 
-def barycentric_coords(vertices, point):
-    # Triangle vertices
-    A, B, C = vertices
+def is_splittable(triangles):
+    """Triangles with legs of a single cell are as small as they can get"""
+    return np.abs(triangles[:, 0] - triangles[:, 2]).sum(axis=1) > 1
 
-    # Vectors
-    v0 = C - A
-    v1 = B - A
-    v2 = point - A
 
-    # Compute dot products
-    dot00 = np.dot(v0, v0)
-    dot01 = np.dot(v0, v1)
-    dot02 = np.dot(v0, v2)
-    dot11 = np.dot(v1, v1)
-    dot12 = np.dot(v1, v2)
+def get_rtin_roots(size):
+    """The two triangles that cover a `size` x `size` grid, split along its diagonal"""
+    tile = size - 1
+    return np.array(
+        [[[tile, tile], [0, 0], [0, tile]], [[0, 0], [tile, tile], [tile, 0]]],
+        dtype=np.int32,
+    )
 
-    # Compute barycentric coordinates
-    inv_denom = 1 / (dot00 * dot11 - dot01 * dot01)
-    u = (dot11 * dot02 - dot01 * dot12) * inv_denom
-    v = (dot00 * dot12 - dot01 * dot02) * inv_denom
 
-    return u, v
+@functools.lru_cache(maxsize=4)
+def get_rtin_levels(size):
+    """
+    Every splittable triangle of a right-triangulated irregular network (RTIN) over a
+    `size` x `size` grid, where size is 2^n+1. Each level splits every triangle of the one
+    before it, down to triangles with diagonal legs of one cell.
+
+    The levels are cached per size and read-only, as they only depend on the grid.
+    """
+    levels = []
+    triangles = get_rtin_roots(size)
+    # all triangles in a level are the same shape, so checking one is enough
+    while is_splittable(triangles[:1]).all():
+        triangles.flags.writeable = False
+        levels.append(triangles)
+        triangles = split_rtin_triangles(triangles)
+    return levels
+
+
+def get_rtin_errors(heights, lock_edges=False):
+    """
+    The error of every grid point, i.e. how far the terrain would be from the full resolution
+    one if the triangles split at that point weren't split. A triangle's error includes the
+    errors of all of its children, so splitting one triangle also splits its neighbours and
+    the mesh never has cracks.
+
+    `lock_edges` -- never simplify the edges of the grid, so tiles still line up (default=False)
+    """
+    size = heights.shape[0]
+    flat_heights = heights.ravel()
+    errors = np.zeros(size * size)
+    index = lambda points: points[..., 1] * size + points[..., 0]
+    levels = get_rtin_levels(size)
+    # from the smallest triangles up, so children are done before their parents
+    for depth in range(len(levels) - 1, -1, -1):
+        triangles = levels[depth]
+        a, b = index(triangles[:, 0]), index(triangles[:, 1])
+        m = index((triangles[:, 0] + triangles[:, 1]) // 2)
+        error = np.abs((flat_heights[a] + flat_heights[b]) / 2 - flat_heights[m])
+        if lock_edges:
+            mx, my = (triangles[:, 0] + triangles[:, 1]).T // 2
+            on_edge = (mx == 0) | (my == 0) | (mx == size - 1) | (my == size - 1)
+            error[on_edge] = np.inf
+        if depth < len(levels) - 1:
+            # the midpoints of the (c, a, m) and (b, c, m) children
+            left = index((triangles[:, 2] + triangles[:, 0]) // 2)
+            right = index((triangles[:, 1] + triangles[:, 2]) // 2)
+            error = np.maximum(error, np.maximum(errors[left], errors[right]))
+        # neighbouring triangles share a hypotenuse, so midpoints can repeat
+        np.maximum.at(errors, m, error)
+    return errors
+
+
+def get_rtin_faces(errors, size, max_error):
+    """
+    The triangles of the RTIN mesh with the given `max_error`, as indices into the flattened
+    `size` x `size` grid, wound counter-clockwise so their normals point up
+    """
+    triangles = get_rtin_roots(size)
+    faces = []
+    while len(triangles):
+        m = (triangles[:, 0] + triangles[:, 1]) // 2
+        split = is_splittable(triangles) & (
+            errors[m[:, 1] * size + m[:, 0]] > max_error
+        )
+        faces.append(triangles[~split])
+        triangles = split_rtin_triangles(triangles[split])
+    faces = np.concatenate(faces)
+    # flip the clockwise triangles, found by the sign of the cross product's z
+    ab, ac = faces[:, 1] - faces[:, 0], faces[:, 2] - faces[:, 0]
+    clockwise = ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0] < 0
+    faces[clockwise] = faces[clockwise][:, [0, 2, 1]]
+    return faces[..., 1] * size + faces[..., 0]
+
+
+def simplify_ground_mesh(mesh, max_error, lock_edges=False):
+    """
+    Creates a ground mesh with fewer triangles where the terrain is flat, using a right-
+    triangulated irregular network (RTIN) over the mesh's height grid
+    `mesh` -- a mesh made by `create_ground_mesh`
+    `max_error` -- how far (roughly) the simplified terrain can be above or below the full one
+    `lock_edges` -- keep the edges at full resolution, so tiles still line up (default=False)
+
+    Grids that aren't 2^n+1 points across are resampled to the next size up first
+    """
+    heights = mesh.metadata["height_grid"]
+    width, depth = mesh.metadata["size"]
+    size = get_heightmap_size(heights.shape[0])
+    heights = resample_heights(heights, size)
+    errors = get_rtin_errors(heights, lock_edges)
+    faces = get_rtin_faces(errors, size, max_error)
+    # only keep the grid points that are used, renumbering the faces to match
+    used, faces = np.unique(faces, return_inverse=True)
+    vertices = create_vertices(heights, size, width, depth)[used]
+    simplified = Trimesh(
+        vertices=vertices,
+        faces=faces.reshape(-1, 3),
+        visual=visual.TextureVisuals(),
+        process=False,
+    )
+    unwrap_mesh(simplified)
+    return simplified
 
 
-def is_within_triange(triange, point):
-    u, v = barycentric_coords(triange, point)
-    is_inside = (u >= 0) and (v >= 0) and (u + v < 1)
-    return is_inside
+def displace_mesh(mesh, displacement, scale, rotation_axis, rotation_angle):
+    rotate_mesh(mesh, rotation_angle, rotation_axis)
+    scale_mesh(mesh, scale)
+    translate_mesh(mesh, displacement)
 
 
-def find_closest_z(mesh, point):
+def find_closest_z(mesh, points, default=0):
     """
-    Find the closest face to a given point
+    Find the height of the ground mesh at the given (x, y) points
+
+    The ground mesh is the regular grid made by `create_vertices`, so the cell containing each
+    point is found directly from its coordinates and the height is interpolated across the same
+    triangle `create_faces` uses for that part of the cell.
 
-    :param mesh Trimesh: ground mesh
-    :param point []: (x, y) point
+    :param mesh Trimesh: ground mesh created by `create_ground_mesh`
+    :param points []: a single (x, y) point or an `(N, 2)` array of points
+    :param default float: height used for points outside of the mesh
+    :returns float or (N,) array: height for each point
     """
-    for face in mesh.faces:
-        # z axis can be ignored
-        p1 = mesh.vertices[face[0]]
-        p2 = mesh.vertices[face[1]]
-        p3 = mesh.vertices[face[2]]
-        if is_within_triange([p1[:2], p2[:2], p3[:2]], point):
-            # Find the plane equation of the triangle
-            normal = np.cross(p2 - p1, p3 - p1)
-            D = -np.dot(normal, p1)
-            x, y = point
+    heights = mesh.metadata["height_grid"]
+    width, depth = mesh.metadata["size"]
+    resolution = heights.shape[0]
+    points = np.asarray(points, dtype=float)
+    xy = np.atleast_2d(points)
+
+    # position of each point in grid units, where (0, 0) is the first vertex
+    col = (xy[:, 0] + width / 2) / width * (resolution - 1)
+    row = (xy[:, 1] + depth / 2) / depth * (resolution - 1)
+    is_inside = (
+        (col >= 0) & (col <= resolution - 1) & (row >= 0) & (row <= resolution - 1)
+    )
+    # points on the last row/column belong to the cell before it
+    i = np.clip(np.floor(row).astype(int), 0, max(resolution - 2, 0))
+    j = np.clip(np.floor(col).astype(int), 0, max(resolution - 2, 0))
+    u = np.clip(col - j, 0, 1)
+    v = np.clip(row - i, 0, 1)
+
+    # p1..p4 are the corners of the quad, named the same as in `create_faces`
+    z1 = heights[i, j]
+    z2 = heights[i, j + 1]
+    z3 = heights[i + 1, j + 1]
+    z4 = heights[i + 1, j]
+    # the quad is split along the p1-p3 diagonal into [p1, p2, p3] and [p1, p3, p4]
+    z = np.where(
+        u >= v,
+        z1 + u * (z2 - z1) + v * (z3 - z2),
+        z1 + u * (z3 - z4) + v * (z4 - z1),
+    )
+    z = np.where(is_inside, z, default)
+    return z if points.ndim > 1 else z[0]
+
 
-            # Solve for Z
-            # Ax + By + Cz + D = 0 => z = -(Ax + By + D) / C
-            z = -(normal[0] * x + normal[1] * y + D) / normal[2]
-            return z
+# A placement is everything needed to position one instance of a mesh on the terrain
+PLACEMENT_DTYPE = np.dtype(
+    [
+        ("position", np.float64, 3),
+        ("scale", np.float64),
+        ("axis", np.float64, 3),
+        ("angle", np.float64),
+    ]
+)
 
 
-def create_displaced_meshes(
-    mesh,
+def sample_placements(
     count,
     x_range,
     y_range,
@@ -269,55 +467,127 @@ def create_displaced_meshes(
     rotation_axis_range,
     rotation_angle_range,
     ground_mesh,
+    rng=None,
 ):
-    mesh_array = []
-    for _ in range(count):
-        x_min, x_max = x_range
-        x = np.random.uniform(x_min, x_max)
-        y_min, y_max = y_range
-        y = np.random.uniform(y_min, y_max)
-        z = find_closest_z(ground_mesh, [x, y]) or 0  # if not found do a default of 0
-        scale_min, scale_max = scale_range
-        scale = np.random.uniform(scale_min, scale_max)
-        rotation_axis_min, rotation_axis_max = rotation_axis_range
-        rotation_axis = np.random.uniform(rotation_axis_min, rotation_axis_max)
-        rotation_angle_min, rotation_angle_max = rotation_angle_range
-        rotation_angle = np.random.uniform(rotation_angle_min, rotation_angle_max)
-        dup_mesh = copy.deepcopy(mesh)
-        dup_mesh.metadata["displacement"] = [
-            x,
-            y,
-            z,
-        ]  # quick and dirty way to save mesh position for export
-        displace_mesh(dup_mesh, [x, y, z], scale, rotation_axis, rotation_angle)
-        mesh_array.append(dup_mesh)
-    return mesh_array
-
-
-def create_rock_obstacles(count, x_displacement, y_displacement, ground_mesh):
-    """
-    loads, generates and randomly displaces rock meshes
-
-    :param count int: number of rock meshes to generate
-    :param x_displacement float: amount of space rock mesh can displace
-    :param y_displacement float: amount of space rock mesh can displace
-    :param ground_mesh Trimesh: mesh that rock obstacles will be projected onto (the z_displacement)
     """
+    Randomly samples `count` placements in one go, with each instance resting on the ground mesh
+
+    :param rng np.random.Generator: source of randomness, pass a seeded one for repeatable
+    placements (default: a new unseeded generator)
+    :returns (count,) structured array of `PLACEMENT_DTYPE`
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    placements = np.zeros(count, dtype=PLACEMENT_DTYPE)
     if count == 0:
-        return []
+        return placements
+    positions = placements["position"]
+    positions[:, 0] = rng.uniform(*x_range, size=count)
+    positions[:, 1] = rng.uniform(*y_range, size=count)
+    # if not found do a default of 0
+    positions[:, 2] = find_closest_z(ground_mesh, positions[:, :2])
+    placements["scale"] = rng.uniform(*scale_range, size=count)
+    rotation_axis_min, rotation_axis_max = rotation_axis_range
+    placements["axis"] = rng.uniform(
+        rotation_axis_min, rotation_axis_max, size=(count, 3)
+    )
+    placements["angle"] = rng.uniform(*rotation_angle_range, size=count)
+    return placements
 
+
+def placement_matrices(placements):
+    """
+    Builds the `(N, 4, 4)` transforms for a placement array. Each one rotates, then scales,
+    then translates, the same as `displace_mesh`.
+    """
+    count = len(placements)
+    axis = placements["axis"]
+    axis = axis / np.linalg.norm(axis, axis=1, keepdims=True)
+    angle = placements["angle"]
+    cos = np.cos(angle)[:, None, None]
+    sin = np.sin(angle)[:, None, None]
+    x, y, z = axis.T
+    zeros = np.zeros(count)
+    cross = np.stack(
+        [
+            np.stack([zeros, -z, y], axis=-1),
+            np.stack([z, zeros, -x], axis=-1),
+            np.stack([-y, x, zeros], axis=-1),
+        ],
+        axis=1,
+    )
+    outer = axis[:, :, None] * axis[:, None, :]
+    # Rodrigues' rotation formula
+    rotation = cos * np.eye(3) + sin * cross + (1 - cos) * outer
+
+    matrices = np.zeros((count, 4, 4))
+    matrices[:, :3, :3] = rotation * placements["scale"][:, None, None]
+    matrices[:, :3, 3] = placements["position"]
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+def merge_instances(mesh, transforms):
+    """
+    Combines a copy of `mesh` at each of the `(N, 4, 4)` transforms into one mesh, so every
+    instance can be drawn in a single batch rather than as a node each. UVs and colors are
+    repeated for each copy, so they share the same texture or colors
+    """
+    count = len(transforms)
+    vertex_count = len(mesh.vertices)
+    # (V, 3) @ (N, 3, 3) -> (N, V, 3), each instance's vertices rotated and scaled
+    vertices = np.asarray(mesh.vertices) @ transforms[:, :3, :3].transpose(0, 2, 1)
+    vertices += transforms[:, None, :3, 3]
+    faces = mesh.faces[None] + (np.arange(count) * vertex_count)[:, None, None]
+    merged = Trimesh(
+        vertices=vertices.reshape(-1, 3), faces=faces.reshape(-1, 3), process=False
+    )
+    if mesh.visual.kind == "texture" and mesh.visual.uv is not None:
+        merged.visual = visual.TextureVisuals(
+            uv=np.tile(mesh.visual.uv, (count, 1)), material=mesh.visual.material
+        )
+    elif mesh.visual.kind == "vertex":
+        merged.visual.vertex_colors = np.tile(mesh.visual.vertex_colors, (count, 1))
+    elif mesh.visual.kind == "face":
+        merged.visual.face_colors = np.tile(mesh.visual.face_colors, (count, 1))
+    return merged
+
+
+def decimate_ground_mesh(mesh, resolution):
+    """
+    A copy of a ground mesh resampled to at most `resolution` x `resolution` points, e.g. for
+    display. It has no uv map, so it's much quicker to make than with `create_ground_mesh`
+    `mesh` -- a mesh made by `create_ground_mesh`
+    """
+    heights = mesh.metadata["height_grid"]
+    width, depth = mesh.metadata["size"]
+    resolution = min(resolution, heights.shape[0])
+    heights = resample_heights(heights, resolution)
+    return Trimesh(
+        vertices=create_vertices(heights, resolution, width, depth),
+        faces=create_faces(resolution),
+        process=False,
+    )
+
+
+def load_rock_mesh():
     mesh_path = Path(Path.cwd(), "assets/meshes/rock/meshes/Rock1.dae")
-    rock_mesh = load.load(mesh_path, force="mesh")
+    # the cached mesh is shared, so copy it before changing the metadata and material
+    rock_mesh = asset_cache.load_mesh(mesh_path).copy()
     rock_mesh.metadata["name"] = "rock"  # type: ignore
     texture_path = Path(
         Path.cwd(), "assets/meshes/rock/materials/textures/rock-diffuse.png"
     )
-    material = visual.material.SimpleMaterial(image=Image.open(texture_path))
+    material = visual.material.SimpleMaterial(
+        image=asset_cache.load_image(texture_path)
+    )
     rock_mesh.visual.material = material  # type: ignore
+    return rock_mesh
+
+
+def place_rocks(count, x_displacement, y_displacement, ground_mesh, rng=None):
     rotation_angle = [0, np.pi * 2]
     rotation_axis = [[-0.5, -0.5, -0.5], [0.5, 0.5, 0.5]]
-    rocks = create_displaced_meshes(
-        rock_mesh,
+    return sample_placements(
         count,
         x_displacement,
         y_displacement,
@@ -325,16 +595,14 @@ def create_rock_obstacles(count, x_displacement, y_displacement, ground_mesh):
         rotation_axis,
         rotation_angle,
         ground_mesh,
+        rng,
     )
-    return rocks
 
 
-def create_tree_obstacles(count, x_displacement, y_displacement, ground_mesh):
-    if count == 0:
-        return []
+def load_tree_mesh():
     tree_mesh_path = Path(Path.cwd(), "assets/meshes/oak_tree/meshes/oak_tree.dae")
     # leaves_mesh_path = Path(Path.cwd(), "assets/meshes/tree_8/crown8.obj")
-    tree_mesh = load.load(tree_mesh_path, force="mesh")
+    tree_mesh = asset_cache.load_mesh(tree_mesh_path).copy()
     # leaves_mesh = load.load(leaves_mesh_path, force="mesh")
     tree_mesh.metadata["name"] = "tree"
 
@@ -343,13 +611,13 @@ def create_tree_obstacles(count, x_displacement, y_displacement, ground_mesh):
     texture = visual.TextureVisuals(image=texture_path)
     # trimesh.visual.material.pack # <== look into this more
     tree_mesh.visual.texture = texture
+    return tree_mesh
 
+
+def place_trees(count, x_displacement, y_displacement, ground_mesh, rng=None):
     rotation_angle = [0, np.pi * 2]
     rotation_axis = [[-0.5, -0.5, 1], [1, 1, 1]]
-
-    # Combine the individual box meshes into a single mesh
-    return create_displaced_meshes(
-        tree_mesh,
+    return sample_placements(
         count,
         x_displacement,
         y_displacement,
@@ -357,15 +625,18 @@ def create_tree_obstacles(count, x_displacement, y_displacement, ground_mesh):
         rotation_axis,
         rotation_angle,
         ground_mesh,
+        rng,
     )
 
 
-def create_grass(count, x_displacement, y_displacement, ground_mesh):
+def load_grass_mesh():
     grass_mesh_path = Path(Path.cwd(), "assets/meshes/grass_blade/meshes/model.dae")
-    grass_mesh = load.load(grass_mesh_path, force="mesh")
+    return asset_cache.load_mesh(grass_mesh_path)
+
+
+def place_grass(count, x_displacement, y_displacement, ground_mesh, rng=None):
     rotation_axis = [[1, -0.5, 1], [1, 1, 1]]
-    return create_displaced_meshes(
-        grass_mesh,
+    return sample_placements(
         count,
         x_displacement,
         y_displacement,
@@ -373,17 +644,5 @@ def create_grass(count, x_displacement, y_displacement, ground_mesh):
         rotation_axis,
         rotation_angle_range=[np.pi, np.pi * 2],
         ground_mesh=ground_mesh,
+        rng=rng,
     )
-
-
-def create_obstacles(
-    rock_count, tree_count, x_displacement, y_displacement, ground_mesh
-):
-    rocks = create_rock_obstacles(
-        rock_count, x_displacement, y_displacement, ground_mesh
-    )
-    trees = create_tree_obstacles(
-        tree_count, x_displacement, y_displacement, ground_mesh
-    )
-
-    return rocks + trees
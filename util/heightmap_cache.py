@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import threading
+from util.terrain_defaults import settings
+
+
+def canonical_noise_options(noise_options):
+    """
+    Coerce every noise option to the type of its default, e.g. "0.10" -> 0.1, so options that
+    came from a slider, a yml preset or code all compare equal
+    """
+    canonical = {}
+    for option, value in noise_options.items():
+        default = settings["noise_options"].get(option)
+        if isinstance(default, bool) or default is None:
+            canonical[option] = value
+        elif isinstance(default, int):
+            canonical[option] = int(float(value))
+        elif isinstance(default, float):
+            canonical[option] = float(value)
+        else:
+            canonical[option] = str(value)
+    return canonical
+
+
+def heightmap_key(
+    noise_type, resolution, noise_options, seed=0, start=(0, 0), offset=None, step=1
+):
+    return (
+        str(noise_type),
+        int(resolution),
+        tuple(sorted(canonical_noise_options(noise_options).items())),
+        int(seed),
+        tuple(int(i) for i in start),
+        None if offset is None else float(offset),
+        float(step),
+    )
+
+
+class HeightmapCache:
+    """
+    A least recently used cache of generated heightmaps, limited to `max_bytes` in total.
+
+    Cached arrays are read-only, as they're shared between everyone who asks for the same key.
+    """
+
+    def __init__(self, max_bytes=256 * 1024**2):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._size = 0
+        # the preview is generated on a background thread while exports run on the main thread
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            array = self._items.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return array
+
+    def put(self, key, array):
+        array = array.view()
+        array.flags.writeable = False
+        with self._lock:
+            if key in self._items:
+                self._size -= self._items.pop(key).nbytes
+            if array.nbytes > self.max_bytes:
+                # would evict everything else and still not fit
+                return array
+            self._items[key] = array
+            self._size += array.nbytes
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= evicted.nbytes
+                self.evictions += 1
+        return array
+
+    def get_or_create(self, key, create):
+        """Returns the cached heightmap for `key`, calling `create()` to make it on a miss"""
+        array = self.get(key)
+        if array is None:
+            array = self.put(key, create())
+        return array
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._items),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+heightmap_cache = HeightmapCache()
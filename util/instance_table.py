@@ -0,0 +1,109 @@
+import numpy as np
+from trimesh import scene
+
+from util.generate_mesh import (
+    load_grass_mesh,
+    load_rock_mesh,
+    load_tree_mesh,
+    merge_instances,
+    placement_matrices,
+)
+
+
+class InstanceTable:
+    """
+    A compact table of every rock, tree and grass blade placed on the terrain.
+
+    Rather than a full copy of a mesh per instance, each kind has one shared prototype mesh,
+    and each instance is just a row in an `(N, 4, 4)` transform buffer with a matching kind id.
+    """
+
+    # the order here is also the order instances are stored in
+    kinds = ["rock", "tree", "grass"]
+    prototype_loaders = {
+        "rock": load_rock_mesh,
+        "tree": load_tree_mesh,
+        "grass": load_grass_mesh,
+    }
+
+    def __init__(self):
+        self._transforms = np.zeros((0, 4, 4))
+        self._kind_ids = np.zeros(0, dtype=np.uint8)
+        self._prototypes = {}
+
+    def __len__(self):
+        return len(self._kind_ids)
+
+    def set_instances(self, kind, placements):
+        """
+        Replaces every instance of `kind` with the given placements
+
+        :param kind str: one of `InstanceTable.kinds`
+        :param placements []: structured array of `PLACEMENT_DTYPE`
+        """
+        kind_id = self.get_kind_id(kind)
+        keep = self._kind_ids != kind_id
+        transforms = np.concatenate(
+            [self._transforms[keep], placement_matrices(placements)]
+        )
+        kind_ids = np.concatenate(
+            [self._kind_ids[keep], np.full(len(placements), kind_id, dtype=np.uint8)]
+        )
+        # keep instances grouped by kind, in the order of `kinds`
+        order = np.argsort(kind_ids, kind="stable")
+        self._transforms = np.ascontiguousarray(transforms[order])
+        self._kind_ids = kind_ids[order]
+
+    def clear(self):
+        self._transforms = np.zeros((0, 4, 4))
+        self._kind_ids = np.zeros(0, dtype=np.uint8)
+
+    def get_kind_id(self, kind):
+        return self.kinds.index(kind)
+
+    def get_kind_ids(self):
+        return self._kind_ids
+
+    def get_mask(self, kinds=None):
+        """Returns a mask of the instances of a kind, or a list of kinds"""
+        if kinds is None:
+            return np.ones(len(self), dtype=bool)
+        if isinstance(kinds, str):
+            kinds = [kinds]
+        kind_ids = [self.get_kind_id(kind) for kind in kinds]
+        return np.isin(self._kind_ids, kind_ids)
+
+    def get_transforms(self, kinds=None):
+        return self._transforms[self.get_mask(kinds)]
+
+    def get_positions(self, kinds=None):
+        return self._transforms[self.get_mask(kinds), :3, 3]
+
+    def get_names(self, kinds=None):
+        return [self.kinds[kind_id] for kind_id in self._kind_ids[self.get_mask(kinds)]]
+
+    def count(self, kinds=None):
+        return int(np.count_nonzero(self.get_mask(kinds)))
+
+    def get_prototype(self, kind):
+        """The shared mesh for a kind. It's only loaded the first time it's needed"""
+        if kind not in self._prototypes:
+            self._prototypes[kind] = self.prototype_loaders[kind]()
+        return self._prototypes[kind]
+
+    def to_merged_scene(self, ground_mesh):
+        """
+        A trimesh scene with every instance of a kind merged into one mesh, so it's drawn as
+        one batch per kind rather than one node per instance
+        """
+        world = scene.scene.Scene(ground_mesh)
+        for kind in self.kinds:
+            transforms = self.get_transforms(kind)
+            if len(transforms) == 0:
+                continue
+            world.add_geometry(
+                merge_instances(self.get_prototype(kind), transforms),
+                node_name=kind,
+                geom_name=kind,
+            )
+        return world
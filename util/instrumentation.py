@@ -0,0 +1,197 @@
+"""
+Named spans that record how long each stage of generating and exporting a world takes, and
+how much it changed the process' resident memory.
+
+Spans are only recorded inside a run (see `Instrumentation.run`), and only on the thread that
+started it, so they cost next to nothing otherwise. A run keeps its spans for a report or a
+chrome trace, and listeners are told about each span as it finishes, e.g. to show a live
+breakdown in the UI.
+
+Set `TERRAIN_PROFILE=1` to print a report after every run, and `TERRAIN_TRACE_DIR` to write
+every run there as chrome trace-event json (open it in chrome://tracing or ui.perfetto.dev).
+Both are read from the environment when a run ends, so they work in worker processes too.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+import psutil
+
+
+def get_rss():
+    """@returns the resident memory of this process in bytes"""
+    # not kept between calls, as a forked process would keep reading its parent's memory
+    return psutil.Process().memory_info().rss
+
+
+class Run:
+    """Every span recorded between the start and end of one run"""
+
+    def __init__(self, name):
+        self.name = name
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+        # finished spans, in the order they finished, so children come before their parent
+        self.spans = []
+        # how many spans are open, so each span knows how deeply it's nested
+        self.depth = 0
+
+    def get_report(self):
+        """
+        Totals the spans with the same name and nesting, in the order they started
+
+        @returns a list of {"name", "depth", "count", "seconds", "memory_delta"}, where
+        `memory_delta` is in bytes
+        """
+        totals = {}
+        for span in sorted(self.spans, key=lambda span: span["start"]):
+            key = (span["name"], span["depth"])
+            if key not in totals:
+                totals[key] = {
+                    "name": span["name"],
+                    "depth": span["depth"],
+                    "count": 0,
+                    "seconds": 0,
+                    "memory_delta": 0,
+                }
+            totals[key]["count"] += 1
+            totals[key]["seconds"] += span["seconds"]
+            totals[key]["memory_delta"] += span["memory_delta"]
+        return list(totals.values())
+
+    def format_report(self):
+        """The report as a table, with nested spans indented under their parent"""
+        lines = [f"{'span':<32} {'count':>5} {'seconds':>9} {'memory MB':>10}"]
+        for total in self.get_report():
+            name = "  " * total["depth"] + total["name"]
+            lines.append(
+                f"{name:<32} {total['count']:>5} {total['seconds']:>9.3f}"
+                + f" {total['memory_delta'] / 1024**2:>+10.1f}"
+            )
+        return "\n".join(lines)
+
+    def to_chrome_trace(self):
+        """The spans as chrome trace-event json, with times relative to the run's start"""
+        events = [
+            {
+                "name": span["name"],
+                "cat": "terrain",
+                "ph": "X",
+                "ts": (span["start"] - self.start) * 1e6,
+                "dur": span["seconds"] * 1e6,
+                "pid": self.pid,
+                "tid": span["thread"],
+                "args": {"memory_delta": span["memory_delta"], **span["args"]},
+            }
+            for span in self.spans
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+class Instrumentation:
+    """Records spans into the current thread's run, see the module docstring"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._listeners = []
+        self._lock = threading.Lock()
+        # the most recent run to finish on any thread
+        self.last_run = None
+
+    def get_current_run(self):
+        run = getattr(self._local, "run", None)
+        # a forked process inherits the run of the thread that forked it, but not its spans
+        if run is not None and run.pid != os.getpid():
+            return None
+        return run
+
+    def add_listener(self, listener):
+        """
+        :param listener callable: called as `listener(run, span)` on the span's own thread
+        whenever a span finishes
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    @contextmanager
+    def run(self, name):
+        """
+        Records every span on this thread until the run ends, with the run itself as the
+        outermost span. A run started inside another run is just a span of the outer one
+
+        @returns the `Run`
+        """
+        current = self.get_current_run()
+        if current is not None:
+            with self.span(name):
+                yield current
+            return
+        run = Run(name)
+        self._local.run = run
+        try:
+            with self.span(name):
+                yield run
+        finally:
+            self._local.run = None
+            self.last_run = run
+            self.on_run_end(run)
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Records how long the block takes and how much it changes resident memory
+
+        :param args: anything else worth keeping in the trace, e.g. the mesh format
+        """
+        run = self.get_current_run()
+        if run is None:
+            yield
+            return
+        memory = get_rss()
+        start = time.perf_counter()
+        run.depth += 1
+        try:
+            yield
+        finally:
+            run.depth -= 1
+            span = {
+                "name": name,
+                "start": start,
+                "seconds": time.perf_counter() - start,
+                "memory_delta": get_rss() - memory,
+                "depth": run.depth,
+                "thread": threading.get_ident(),
+                "args": args,
+            }
+            run.spans.append(span)
+            with self._lock:
+                listeners = list(self._listeners)
+            for listener in listeners:
+                listener(run, span)
+
+    def on_run_end(self, run):
+        if os.environ.get("TERRAIN_PROFILE"):
+            print(run.format_report())
+        trace_dir = os.environ.get("TERRAIN_TRACE_DIR")
+        if trace_dir:
+            Path(trace_dir).mkdir(parents=True, exist_ok=True)
+            file_name = re.sub(r"[^\w.-]", "_", run.name)
+            run.export_chrome_trace(
+                Path(trace_dir, f"{file_name}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+            )
+
+
+instrumentation = Instrumentation()
+span = instrumentation.span
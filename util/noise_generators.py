@@ -1,10 +1,18 @@
 import numpy as np
 import pyfastnoisesimd as fns
 
+# genAsGrid only fills grids whose size is a multiple of the SIMD vector length, which is at
+# most 16 floats (AVX-512). Grids are padded up to it, then cropped
+SIMD_FLOATS = 16
+
 
 def custom_noise(
     resolution=48,
     noise_type="Perlin",
+    seed=0,
+    start=(0, 0),
+    offset=None,
+    step=1,
     fractal_octaves=2,
     fractal_gain=0.5,
     fractal_lacunarity=2,
@@ -22,8 +30,23 @@ def custom_noise(
     cellular_jitter=0.45,
     cellular_lookup_frequency=0.2,
 ):
-    noise = fns.Noise(0)
+    """
+    Generates a `(resolution, resolution)` heightmap
+
+    `start` -- the grid (row, column) the heightmap starts at. Tiles of a larger terrain start
+    `resolution - 1` apart, so neighbouring tiles share their edge values (default=(0, 0))
+    `offset` -- added to every value. By default the minimum is lifted to 0, but tiles must
+    all use the same offset to line up (default=None)
+    `step` -- the distance between samples, in grid points. A heightmap with a `step` of
+    `(resolution - 1) / (size - 1)` and a resolution of `size` covers the same terrain as the
+    full one, e.g. for a small preview of a large heightmap. `start` is scaled too (default=1)
+    """
+    noise = fns.Noise(seed)
     noise.frequency = frequency
+    if step != 1:
+        # scales the sample coordinates, so every octave, perturb and cell is sampled at the
+        # same points as in the full resolution grid
+        noise.axesScales = (step, step, 1)
     noise.noiseType = fns.NoiseType[noise_type]
     noise.fractal.fractalType = fns.FractalType[fractal_type]
     noise.fractal.octaves = fractal_octaves
@@ -46,8 +69,14 @@ def custom_noise(
         noise.cell.lookupFrequency = cellular_lookup_frequency
         noise.cell.noiseLookupType = fns.NoiseType[noise_type]
 
-    array = noise.genAsGrid([resolution, resolution, resolution])
-    sliced_array = array[:, :, 1]  # we just want the y axis
-    offset_array = sliced_array + abs(sliced_array.min())  # remove negative values
+    # Only a single z slice is needed for a heightmap, so generate a grid with a depth of 1
+    # starting at z=1 rather than a resolution^3 volume that is then sliced down.
+    # This gives the same values as `genAsGrid([res, res, res])[:, :, 1]` with O(res^2) work
+    padded_columns = -(-resolution // SIMD_FLOATS) * SIMD_FLOATS
+    array = noise.genAsGrid([resolution, padded_columns, 1], start=[*start, 1])
+    sliced_array = array[:, :resolution, 0]
+    if offset is None:
+        offset = abs(sliced_array.min())  # remove negative values
+    offset_array = sliced_array + offset
 
     return offset_array
@@ -0,0 +1,77 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+from util import asset_cache
+
+# Each worker process keeps one controller and reuses it for every job it's given
+_controller = None
+
+
+def create_controller():
+    # imported here so the parent process doesn't need to build a model of its own
+    from controllers.terrain_generator import TerrainGeneratorController
+    from models.terrain_generator import TerrainGeneratorModel
+
+    return TerrainGeneratorController(TerrainGeneratorModel())
+
+
+def init_worker(asset_cache_dir=None):
+    """
+    Runs once in each worker process, before any jobs. Exports only need the positions of
+    obstacles, so their meshes are only parsed if something asks for them
+    """
+    global _controller
+    asset_cache.set_disk_cache_dir(asset_cache_dir)
+    _controller = create_controller()
+
+
+def get_worker_controller():
+    """
+    The controller of the current worker process, see `init_worker`. None outside of a worker
+    """
+    return _controller
+
+
+def generate_world(settings, seed, world_name, world_dir, force=False):
+    """Builds and exports a single world in a worker process"""
+    start = time.perf_counter()
+    _controller.apply_settings({**settings, "seed": seed})
+    _controller.export_world(world_name, world_dir=world_dir, force=force)
+    return world_name, time.perf_counter() - start
+
+
+def get_world_name(settings, seed, index):
+    return settings.get("name") or f"world_{index}_{seed}"
+
+
+def generate_worlds_parallel(
+    jobs, world_dir="./worlds", max_workers=None, asset_cache_dir=None, force=False
+):
+    """
+    Generates and exports worlds across a pool of processes, yielding
+    `(world_name, seconds)` as each one finishes (not in the order they were given).
+
+    :param jobs []: `(settings, seed)` pairs, where `settings` is a settings dict like the yml
+    presets. An optional "name" key in `settings` is used as the world name
+    :param world_dir str: where to write the .world files
+    :param max_workers int: number of processes (default: one per core)
+    :param asset_cache_dir str: where workers can share parsed meshes (default: memory only)
+    :param force bool: export worlds even if they're already up to date
+    """
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=init_worker,
+        initargs=(asset_cache_dir or asset_cache.get_disk_cache_dir(),),
+    ) as executor:
+        futures = [
+            executor.submit(
+                generate_world,
+                settings,
+                seed,
+                get_world_name(settings, seed, index),
+                world_dir,
+                force,
+            )
+            for index, (settings, seed) in enumerate(jobs)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
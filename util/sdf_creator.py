@@ -14,6 +14,27 @@ def create_geometry_sdf(mesh_uri, scale, submesh_name=False):
     return geometry
 
 
+def create_heightmap_geometry_sdf(heightmap_uri, size, pos, textures=()):
+    """
+    `size` -- the [x, y, z] size of the heightmap, where z is the height of a white pixel
+    `pos` -- the position of the heightmap's center and lowest point
+    `textures` -- (diffuse_uri, normal_uri, size) for each texture. Only used for visuals
+    """
+    heightmap = create_sdf_element("heightmap")
+    geometry = create_sdf_element("geometry")
+    heightmap.uri = heightmap_uri  # type: ignore
+    heightmap.size = size  # type: ignore
+    heightmap.pos = pos  # type: ignore
+    for diffuse, normal, texture_size in textures:
+        texture = create_sdf_element("texture")
+        texture.diffuse = diffuse  # type: ignore
+        texture.normal = normal  # type: ignore
+        texture.size = [texture_size]  # type: ignore
+        heightmap.add_texture(texture=texture)  # type: ignore
+    geometry.heightmap = heightmap  # type: ignore
+    return geometry
+
+
 def create_tree_sdf(
     mesh_uri, script_uris, model_name, model_pose, material_names, scale
 ):
@@ -51,7 +72,10 @@ def create_tree_sdf(
     return model
 
 
-def create_ground_sdf(mesh_uri, model_name, model_pose, material_name, scale):
+def create_ground_sdf(
+    mesh_uri, model_name, model_pose, material_name, scale, collision_uri=None
+):
+    """`collision_uri` -- a (usually coarser) mesh for collisions, instead of `mesh_uri`"""
     uri = create_sdf_element("uri")
     uri2 = create_sdf_element("uri")
     script = create_sdf_element("script")
@@ -76,6 +100,8 @@ def create_ground_sdf(mesh_uri, model_name, model_pose, material_name, scale):
     visual.children["material"] = material  # type: ignore
     visual.cast_shadows = True
     visual.name = "visual"  # type: ignore
+    if collision_uri:
+        geometry = create_geometry_sdf(collision_uri, scale)
     collision.children["geometry"] = geometry  # type: ignore
     link.children["collision"] = collision  # type: ignore
     link.children["visual"] = visual  # type: ignore
@@ -86,6 +112,37 @@ def create_ground_sdf(mesh_uri, model_name, model_pose, material_name, scale):
     return model
 
 
+def create_heightmap_sdf(heightmap_uri, model_name, size, pos, texture_size=10):
+    visual = create_sdf_element("visual")
+    collision = create_sdf_element("collision")
+    link = create_sdf_element("link")
+    model = create_sdf_element("model")
+    # gazebo's built in grass texture, as heightmaps can't use material scripts
+    textures = [
+        (
+            "file://media/materials/textures/grass_diffusespecular.png",
+            "file://media/materials/textures/flat_normal.png",
+            texture_size,
+        )
+    ]
+    visual.children["geometry"] = create_heightmap_geometry_sdf(  # type: ignore
+        heightmap_uri, size, pos, textures
+    )
+    visual.cast_shadows = True
+    visual.name = "visual"  # type: ignore
+    collision.children["geometry"] = create_heightmap_geometry_sdf(  # type: ignore
+        heightmap_uri, size, pos
+    )
+    collision.name = "collision"  # type: ignore
+    link.children["collision"] = collision  # type: ignore
+    link.children["visual"] = visual  # type: ignore
+    model.children["link"] = link  # type: ignore
+    model.name = model_name  # type: ignore
+    model.pose = [0, 0, 0, 0, 0, 0]  # type: ignore
+    model.static = True  # type: ignore
+    return model
+
+
 def create_rock_sdf(
     mesh_uri, script_uris, model_name, model_pose, material_name, scale
 ):
@@ -147,6 +204,14 @@ def create_grass_sdf(mesh_uri, model_name, model_pose, material_name, scale):
     return model
 
 
+def create_include_sdf(model_uri, model_name, model_pose):
+    include = create_sdf_element("include")
+    include.uri = model_uri  # type: ignore
+    include.name = model_name  # type: ignore
+    include.pose = model_pose  # type: ignore
+    return include
+
+
 def create_ground_mesh_sdf_elements(mesh_uri, color=[0, 0.5, 0, 1]):
     # list should be in order from child to parent
     sdf_elements = [
@@ -4,14 +4,22 @@ settings = {
     "height_multiplier": 1,
     "resolution": 48,
     "scale": 10,
+    "seed": 0,  # drives the noise and every random placement, so worlds can be regenerated
     "max_angle": 90,
+    "local_clamp": False,
+    "tiles": 1,  # tiles per side. Each tile is width x depth at the full resolution
     "tree_density": 1,
     "rock_density": 1,
     "total_obstacles": 1,
     "mesh_rgba": [0, 128, 0, 1],  # the color the mesh will be
-    "obstacle_items": [],
+    "mesh_format": "obj",  # file format the ground mesh is exported as, see MESH_FORMATS
+    # how far the exported ground mesh may be simplified from the full one, 0 keeps every triangle
+    "max_error": 0,
+    "collision_max_error": 0,  # the same for the collision mesh, usually coarser
+    "ground_type": "mesh",  # export the ground as a "mesh" or a gazebo "heightmap"
     "total_grass": 0,
-    "grass_items": [],
+    # "include" writes each obstacle as an <include> of one shared model instead of in full
+    "instance_mode": "inline",
     "noise_type": "Perlin",
     "noise_options": {
         "fractal_octaves": 2,
@@ -0,0 +1,257 @@
+"""
+Large worlds are split into a grid of `tiles` x `tiles`, each the size and resolution of a
+normal terrain, so memory only grows with the size of one tile. Every tile samples the same
+world-space noise, starting where its neighbour ends, so tiles share their edge vertices.
+
+Tiles are generated in two passes across a process pool. The first only measures each tile,
+so every tile can use the same height offset and angle clamp. The second generates and
+exports each tile as its own model, which the world then includes. Inside a worker of another
+pool, e.g. `generate_worlds_parallel`, or with one worker, tiles run one by one instead.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import functools
+from itertools import repeat
+import multiprocessing
+from pathlib import Path
+import threading
+import numpy as np
+from pcg_gazebo.parsers.sdf import create_sdf_element
+from pcg_gazebo.simulation import World
+from util import asset_cache
+from util.export_cache import get_export_hash, is_export_current, write_manifest
+from util.export_terrain import export_model_config
+from util.generate_mesh import create_vertices, grid_edges
+from util.instrumentation import instrumentation, span
+from util.parallel_generation import (
+    create_controller,
+    get_worker_controller,
+    init_worker,
+)
+from util.world_writer import export_instance_models, write_world
+
+
+def get_tile_name(model_folder, row, col):
+    return f"{model_folder}_tile_{row}_{col}"
+
+
+def get_tile_center(settings, row, col):
+    """The (x, y) of a tile's center, with the whole world centered on the origin"""
+    middle = (settings["tiles"] - 1) / 2
+    return ((col - middle) * settings["width"], (row - middle) * settings["depth"])
+
+
+def get_slope_scale(max_slope, max_angle):
+    """How much the heights must be scaled so no edge is steeper than `max_angle`"""
+    threshold_slope = np.tan(np.radians(max_angle))
+    if max_angle >= 90 or max_slope <= threshold_slope:
+        return 1
+    return threshold_slope / max_slope
+
+
+class SerialExecutor:
+    """
+    Runs tiles one by one in this process, like a pool with one worker. Inside a pool worker the
+    tiles reuse its controller, otherwise they get one of their own so the caller's settings are
+    left as they were
+    """
+
+    def __init__(self, controller=None):
+        self.controller = controller or create_controller()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # the worker's next job may not be tiled
+        self.controller.model.set_tile(None)
+        return False
+
+    def map(self, func, *iterables):
+        return map(functools.partial(func, controller=self.controller), *iterables)
+
+
+def get_tile_executor(max_workers=None, asset_cache_dir=None):
+    """
+    A process pool for the tiles, or a `SerialExecutor` with one worker or when this is already
+    a pool worker, as every worker would otherwise start a pool of its own
+    """
+    if max_workers == 1 or get_worker_controller() is not None:
+        return SerialExecutor(get_worker_controller())
+    # a forked process inherits every lock as it was, so a lock held by another thread (e.g.
+    # the preview worker's heightmap cache) would never be released. Start fresh ones instead
+    context = None
+    if threading.active_count() > 1:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(asset_cache_dir or asset_cache.get_disk_cache_dir(),),
+    )
+
+
+def measure_tile(settings, row, col, controller=None):
+    """
+    Runs in a worker process, or with the `SerialExecutor`'s controller
+
+    @returns the lowest noise value and the steepest slope in a tile
+    """
+    controller = controller or get_worker_controller()
+    model = controller.model
+    # set before the settings, so the noise they regenerate is this tile's and gets cached
+    model.set_tile((row, col), noise_offset=0)
+    controller.apply_settings(settings)
+    params = model.get_heightmap_params()
+    noise = model.create_procedural_array({**params, "height_multiplier": 1})
+    resolution = params["resolution"]
+    vertices = create_vertices(
+        noise * params["height_multiplier"],
+        resolution,
+        settings["width"],
+        settings["depth"],
+    )
+    rise, run = grid_edges(vertices, resolution)
+    return float(noise.min()), float(np.max(np.abs(rise) / run))
+
+
+def export_tile(
+    settings, row, col, noise_offset, height_multiplier, model_folder, controller=None
+):
+    """
+    Runs in a worker process, or with the `SerialExecutor`'s controller. Generates a tile and
+    exports it as its own model
+
+    @returns the tile's name, the files it wrote, and its obstacle names, positions and grass
+    positions in world space
+    """
+    controller = controller or get_worker_controller()
+    model = controller.model
+    model.set_tile((row, col), noise_offset=noise_offset)
+    # the angle is already clamped for the whole world through the height multiplier
+    controller.apply_settings(
+        {**settings, "max_angle": 90, "height_multiplier": height_multiplier}
+    )
+    tile_name = get_tile_name(model_folder, row, col)
+    # the tile is generated in another process, so it's timed as a run of its own
+    with instrumentation.run(tile_name):
+        model.update_mesh()
+
+        tile_path = Path(Path.home(), ".gazebo", "models", tile_name)
+        tile_path.mkdir(parents=True, exist_ok=True)
+        ground_model, ground_files = controller.export_ground(tile_path, tile_name)
+        ground_model.name = tile_name  # type: ignore
+        with span("sdf_build"):
+            sdf = create_sdf_element("sdf")
+            sdf.reset(mode="model")  # type: ignore
+            sdf.children["model"] = ground_model  # type: ignore
+            sdf.export_xml(str(Path(tile_path, "model.sdf")))
+            export_model_config(tile_path)
+
+    # obstacles are placed around the tile's center, so move them to where the tile is
+    offset = [*get_tile_center(settings, row, col), 0]
+    instances = model.get_instances()
+    return (
+        tile_name,
+        [Path(tile_path, f).resolve() for f in [*ground_files, "model.sdf"]],
+        instances.get_names(["rock", "tree"]),
+        instances.get_positions(["rock", "tree"]) + offset,
+        instances.get_positions("grass") + offset,
+    )
+
+
+def export_tiled_world(
+    settings,
+    model_folder,
+    world_name,
+    world_dir="./worlds",
+    max_workers=None,
+    asset_cache_dir=None,
+    force=False,
+):
+    """
+    Exports every tile of a world as its own model, and a world that includes them all.
+    Skipped if the same settings were already exported, unless `force` is set.
+
+    :param settings dict: every setting, as returned by the controller's `get_settings`
+    :param model_folder str: tiles are exported as `<model_folder>_tile_<row>_<col>`
+    :param max_workers int: number of processes, 1 runs the tiles in this process (default:
+    one per core, or 1 inside a pool worker)
+
+    @returns True if the world was exported, False if it was already up to date
+    """
+    tiles = settings["tiles"]
+    world_path = Path(world_dir, world_name)
+    # the first tile always exists, so it holds the manifest for the whole world
+    manifest_path = Path(
+        Path.home(), ".gazebo", "models", get_tile_name(model_folder, 0, 0)
+    )
+    export_hash = get_export_hash(settings, model_folder, world_path)
+    if not force and is_export_current(manifest_path, export_hash):
+        print(f"{world_name} is up to date, skipping export")
+        return False
+    if settings["local_clamp"]:
+        # cutting down one tile's slopes would change its neighbours' edges too
+        print(
+            "local_clamp isn't supported for tiles, the whole world is clamped instead"
+        )
+
+    rows, cols = np.divmod(np.arange(tiles * tiles), tiles)
+    rows, cols = rows.tolist(), cols.tolist()
+    with get_tile_executor(max_workers, asset_cache_dir) as executor:
+        with span("measure_tiles", tiles=tiles * tiles):
+            measurements = list(
+                executor.map(measure_tile, repeat(settings), rows, cols)
+            )
+        noise_min = min(measurement[0] for measurement in measurements)
+        max_slope = max(measurement[1] for measurement in measurements)
+        # the same as a single terrain's offset and angle clamp, but for the whole world
+        height_multiplier = settings["height_multiplier"] * get_slope_scale(
+            max_slope, settings["max_angle"]
+        )
+        # results come back in tile order, so the world is the same however it was split up
+        with span("export_tiles", tiles=tiles * tiles):
+            results = list(
+                executor.map(
+                    export_tile,
+                    repeat(settings),
+                    rows,
+                    cols,
+                    repeat(abs(noise_min)),
+                    repeat(height_multiplier),
+                    repeat(model_folder),
+                )
+            )
+
+    world = World()
+    world = world.to_sdf(with_default_sun=True)
+    files = []
+    for row, col, (tile_name, tile_files, *_) in zip(rows, cols, results):
+        include = create_sdf_element("include")
+        include.uri = f"model://{tile_name}"  # type: ignore
+        include.name = tile_name  # type: ignore
+        include.pose = [*get_tile_center(settings, row, col), 0, 0, 0, 0]  # type: ignore
+        world.add_include(include=include)  # type: ignore
+        files.extend(tile_files)
+    # draw from the world's own generator so exports are reproducible for a seed
+    rng = np.random.default_rng(settings["seed"])
+    Path(world_dir).mkdir(parents=True, exist_ok=True)
+    names = [name for result in results for name in result[2]]
+    grass_positions = np.concatenate([result[4] for result in results])
+    with span("xml_write", instances=len(names) + len(grass_positions)):
+        write_world(
+            world,
+            world_path,
+            names,
+            np.concatenate([result[3] for result in results]),
+            grass_positions,
+            rng,
+            settings["instance_mode"],
+        )
+    if settings["instance_mode"] == "include":
+        with span("instance_models"):
+            files.extend(export_instance_models(manifest_path.parent))
+    with span("manifest"):
+        write_manifest(manifest_path, export_hash, [*files, world_path.resolve()])
+    print(f"world exported with {tiles * tiles} tiles")
+    return True
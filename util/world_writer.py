@@ -0,0 +1,205 @@
+"""
+Writes .world files without building an sdf element for every obstacle and grass blade.
+
+Each kind of instance is rendered once through `util/sdf_creator` as a template, with
+placeholders for its name and pose. Instances are then streamed into the file by filling in
+the template, so memory stays flat and the output is the same as exporting the whole tree.
+
+Instances are either written out in full ("inline"), or as an <include> of a model shared
+by every instance of their kind ("include"), which keeps the world file small.
+"""
+
+import functools
+from pathlib import Path
+import numpy as np
+from pcg_gazebo.parsers.sdf import create_sdf_element
+from util.export_terrain import export_model_config
+from util.sdf_creator import (
+    create_grass_sdf,
+    create_include_sdf,
+    create_rock_sdf,
+    create_tree_sdf,
+)
+
+INSTANCE_MODES = ["inline", "include"]
+# The models instances include. They're made from the same sdf as inline instances, as the
+# models in ./assets/meshes aren't scaled the way the instances are
+INSTANCE_MODELS = {
+    "rock": "terrain_rock",
+    "tree": "terrain_oak_tree",
+    "grass": "terrain_grass_blade",
+}
+
+# unlikely to appear anywhere else in a model, so they can be swapped for the real values
+NAME_PLACEHOLDER = "__instance_name__"
+POSE_PLACEHOLDER = [101, 102, 103, 104, 105, 106]
+# stands in for the instances while the rest of the world is serialised
+INSTANCES_MARKER = "__instances__"
+# models are children of <world>, which is a child of <sdf>
+MODEL_INDENT = "    "
+
+instance_creators = {
+    "rock": lambda name, pose: create_rock_sdf(
+        "model://rock/meshes/Rock1.dae",
+        [
+            "model://rock/materials/scripts/",
+            "model://rock/materials/textures/",
+        ],
+        name,
+        pose,
+        "Rock",
+        [0.2, 0.2, 0.2],
+    ),
+    "tree": lambda name, pose: create_tree_sdf(
+        "model://oak_tree/meshes/oak_tree.dae",
+        [
+            "model://oak_tree/materials/scripts/",
+            "model://oak_tree/materials/textures/",
+        ],
+        name,
+        pose,
+        ["OakTree/Branch", "OakTree/Bark"],
+        [0.4, 0.4, 0.4],
+    ),
+    "grass": lambda name, pose: create_grass_sdf(
+        "model://grass_blade/meshes/model.dae",
+        name,
+        pose,
+        "Gazebo/Green",
+        [0.1, 0.1, 0.1],
+    ),
+}
+
+
+def create_include(kind, name, pose):
+    return create_include_sdf(f"model://{INSTANCE_MODELS[kind]}", name, pose)
+
+
+def export_instance_models(models_dir):
+    """
+    Writes the shared model of each kind of instance to `models_dir`, for "include" mode
+
+    @returns the paths of the files written
+    """
+    files = []
+    for kind, model_name in INSTANCE_MODELS.items():
+        model_path = Path(models_dir, model_name)
+        model_path.mkdir(parents=True, exist_ok=True)
+        sdf = create_sdf_element("sdf")
+        sdf.reset(mode="model")  # type: ignore
+        sdf.children["model"] = instance_creators[kind](  # type: ignore
+            model_name, [0, 0, 0, 0, 0, 0]
+        )
+        sdf.export_xml(str(Path(model_path, "model.sdf")))
+        export_model_config(model_path)
+        files.extend([Path(model_path, "model.sdf"), Path(model_path, "model.config")])
+    return files
+
+
+def format_pose(pose):
+    """Formats numbers the same way pcg_gazebo does"""
+    return " ".join(format(value, "n") for value in pose)
+
+
+@functools.lru_cache(maxsize=None)
+def get_instance_template(kind, instance_mode="inline"):
+    """
+    The xml of one `kind` of instance, indented to sit in a world, with `{name}` and `{pose}`
+    fields to fill in
+    """
+    if instance_mode == "include":
+        model = create_include(kind, NAME_PLACEHOLDER, POSE_PLACEHOLDER)
+    else:
+        model = instance_creators[kind](NAME_PLACEHOLDER, POSE_PLACEHOLDER)
+    xml = model.to_xml_as_str(pretty_print=True)
+    # escape any braces first, so only the placeholders are treated as fields
+    xml = xml.replace("{", "{{").replace("}", "}}")
+    xml = xml.replace(NAME_PLACEHOLDER, "{name}")
+    xml = xml.replace(format_pose(POSE_PLACEHOLDER), "{pose}")
+    return "".join(MODEL_INDENT + line for line in xml.splitlines(keepends=True))
+
+
+def get_obstacle_poses(names, positions, rng):
+    """
+    The pose of each obstacle. Rocks get a random roll, pitch and yaw and trees only a yaw,
+    drawn from `rng` in the order the obstacles are given
+    """
+    is_rock = np.array([name == "rock" for name in names], dtype=bool)
+    draw_counts = np.where(is_rock, 3, 1)
+    # drawing them all at once gives the same numbers as drawing them one by one
+    draws = rng.random(int(draw_counts.sum()))
+    first_draw = np.cumsum(draw_counts) - draw_counts
+    poses = np.zeros((len(names), 6))
+    poses[:, :3] = np.reshape(positions, (-1, 3))
+    rocks = first_draw[is_rock]
+    poses[is_rock, 3:] = draws[rocks[:, None] + np.arange(3)]
+    poses[~is_rock, 5] = draws[first_draw[~is_rock]]
+    return poses
+
+
+def get_grass_poses(grass_positions, rng):
+    """The pose of each grass blade, each with a random roll drawn from `rng`"""
+    poses = np.zeros((len(grass_positions), 6))
+    poses[:, :3] = np.reshape(grass_positions, (-1, 3))
+    poses[:, 3] = rng.random(len(grass_positions))
+    return poses
+
+
+def iter_instance_xml(names, positions, grass_positions, rng, instance_mode="inline"):
+    """
+    Yields the xml of every obstacle and then every grass blade, numbered and rotated the
+    same way as creating their sdf models one by one
+
+    :param names []: "rock" or "tree" for each obstacle
+    :param positions np.ndarray: the (N, 3) world position of each obstacle
+    :param grass_positions np.ndarray: the (M, 3) world position of each grass blade
+    :param rng np.random.Generator: where the rotations are drawn from
+    :param instance_mode str: "inline" or "include", see INSTANCE_MODES
+    """
+    prefixes = {"rock": "Rock", "tree": "Tree"}
+    obstacle_poses = get_obstacle_poses(names, positions, rng)
+    for i, (name, pose) in enumerate(zip(names, obstacle_poses.tolist())):
+        kind = "rock" if name == "rock" else "tree"
+        yield get_instance_template(kind, instance_mode).format(
+            name=f"{prefixes[kind]}_{i}", pose=format_pose(pose)
+        )
+    template = get_instance_template("grass", instance_mode)
+    for i, pose in enumerate(get_grass_poses(grass_positions, rng).tolist()):
+        yield template.format(name=f"Grass_{i}", pose=format_pose(pose))
+
+
+def write_world(
+    world, world_path, names, positions, grass_positions, rng, instance_mode="inline"
+):
+    """
+    Writes `world` to `world_path`, followed by its obstacles and grass, which are streamed
+    in after any models the world already has (e.g. the ground)
+
+    :param world: an sdf <world> element without the instances
+    :param instance_mode str: "inline" or "include". Include mode needs the shared models
+    from `export_instance_models`
+    """
+    marker = create_sdf_element("model")
+    marker.name = INSTANCES_MARKER  # type: ignore
+    models = world.children.get("model", [])
+    world.children["model"] = [*models, marker]
+    sdf = create_sdf_element("sdf")
+    sdf.children["world"] = world  # type: ignore
+    try:
+        xml = sdf.to_xml_as_str(pretty_print=True)
+    finally:
+        world.children["model"] = models
+        if not models:
+            del world.children["model"]
+    marker_xml = "".join(
+        MODEL_INDENT + line
+        for line in marker.to_xml_as_str(pretty_print=True).splitlines(keepends=True)
+    )
+    head, tail = xml.split(marker_xml)
+    with open(world_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" ?>\n')
+        f.write(head)
+        f.writelines(
+            iter_instance_xml(names, positions, grass_positions, rng, instance_mode)
+        )
+        f.write(tail)
@@ -13,11 +13,32 @@ class LoadingBar(tk.Frame):
         # create label
         self.label = tk.Label(self.container_frame, text=self.format_text(label_text))
         self.label.pack(padx=(10, 20))
+        # how long each stage of the current task took, see util/instrumentation
+        self.breakdown_label = tk.Label(
+            self.container_frame, font="TkFixedFont", justify="left"
+        )
+        self.breakdown_label.pack(padx=(10, 20))
 
     def format_text(self, value):
         if value and len(value) > 0:
             return f"Status: {value}"
         return value
 
+    def format_breakdown(self, report):
+        lines = []
+        for total in report:
+            name = "  " * total["depth"] + total["name"]
+            lines.append(
+                f"{name:<20} {total['seconds']:>7.2f}s"
+                + f" {total['memory_delta'] / 1024**2:>+7.1f}MB"
+            )
+        return "\n".join(lines)
+
     def set(self, value):
         self.label.config(text=self.format_text(value))
+
+    def set_breakdown(self, report):
+        """
+        :param report []: a run's report, see `Run.get_report`. An empty list clears it
+        """
+        self.breakdown_label.config(text=self.format_breakdown(report))
@@ -1,6 +1,5 @@
 import time
 import tkinter as tk
-import numpy as np
 from controllers.terrain_generator import TerrainGeneratorController
 from util.app_config import settings
 from PIL import Image, ImageTk
@@ -8,11 +7,22 @@ import glob
 import re
 import os
 import collections
+import threading
 
-from util.array_helpers import normalise_array
+from util.array_helpers import normalise_to_uint8
+from util.background_worker import BackgroundWorker
+from util.instrumentation import instrumentation
 from views.dropdown_menu import Dropdown
+from views.loading_bar import LoadingBar
 from views.slider_control import SliderControl
 
+# how often (ms) to check the background worker for finished previews
+WORKER_POLL_INTERVAL = 30
+# the heightmap preview is this many pixels square
+PREVIEW_SIZE = 300
+# the preview is rendered at these sizes first, so there's something to see straight away
+PREVIEW_LEVELS = [64, 128, 256]
+
 
 class SettingsPanel(tk.Frame):
     def __init__(self, parent, controller):
@@ -33,22 +43,79 @@ class SettingsPanel(tk.Frame):
         self.inputs = self.create_inputs()
         image_array = self.procedural_array_to_image()
         self.image_label = self.noise_frame(image_array)
+        self.loading_bar = LoadingBar(self.main_frame, "Ready")
 
-        # update procedurally generated image when values change
+        # update procedurally generated image when values change.
+        # The heightmap is generated on a background thread so dragging a slider never blocks
+        self.worker = BackgroundWorker()
         self.controller.set_on_value_change(self.on_value_change)
+        self.controller.set_on_heightmap_change(self.schedule_preview)
+        self.after(WORKER_POLL_INTERVAL, self.poll_worker)
         self.create_buttons()
         self.on_noise_type_change(self.controller.get_noise_type())
         self.on_peturb_type_change(self.controller.get_noise_option("perturb_type"))
 
     def procedural_array_to_image(self):
-        procedural_array = self.controller.get_procedural_array()
+        params = self.controller.get_preview_params(PREVIEW_SIZE)
+        return ImageTk.PhotoImage(self.create_preview(params))
 
-        if procedural_array is None:
-            return ImageTk.PhotoImage(np.array([]))  # type: ignore
+    def create_preview(self, params):
+        """
+        Generates the heightmap at no more than the preview's size and renders it. Doesn't
+        touch tkinter, so it's safe to call from the background worker
+        """
+        preview_array = self.controller.create_procedural_array(params)
+        return self.procedural_array_to_pil(preview_array, in_place=True)
+
+    def procedural_array_to_pil(self, procedural_array, in_place=False):
+        """
+        Doesn't touch tkinter, so it's safe to call from the background worker
+
+        :param in_place bool: scale `procedural_array` itself rather than a copy
+        """
         # make array values range from 0 to 255
-        rgb_array = normalise_array(procedural_array) * 255
-        img = Image.fromarray(rgb_array).resize((300, 300))
-        return ImageTk.PhotoImage(img)
+        pixels = normalise_to_uint8(procedural_array, in_place)
+        image = Image.fromarray(pixels)
+        if image.size != (PREVIEW_SIZE, PREVIEW_SIZE):
+            image = image.resize((PREVIEW_SIZE, PREVIEW_SIZE))
+        return image
+
+    def get_preview_sizes(self):
+        """The size of each level of the preview, from coarsest to the final one"""
+        final_size = min(self.controller.get_resolution(), PREVIEW_SIZE)
+        return [size for size in PREVIEW_LEVELS if size < final_size] + [final_size]
+
+    def schedule_preview(self):
+        """
+        Regenerate the preview on the worker, a coarse level first and then finer ones.
+        Only the latest request is kept, so levels left over from an older one are skipped
+        """
+        # the full resolution heightmap is only generated when the mesh is
+        levels = [
+            self.controller.get_preview_params(size)
+            for size in self.get_preview_sizes()
+        ]
+
+        def job(report):
+            for level, params in enumerate(levels, start=1):
+                report(f"Rendering preview ({params['resolution']}px)")
+                yield self.create_preview(params), level == len(levels)
+
+        self.loading_bar.set("Queued")
+        self.worker.submit(job, self.on_preview_ready, self.loading_bar.set)
+
+    def on_preview_ready(self, result):
+        img, is_final = result
+        self.photo_image = ImageTk.PhotoImage(img)
+        self.image_label.configure(
+            image=self.photo_image, width=PREVIEW_SIZE, height=PREVIEW_SIZE
+        )
+        if is_final:
+            self.loading_bar.set("Ready")
+
+    def poll_worker(self):
+        self.worker.poll()
+        self.after(WORKER_POLL_INTERVAL, self.poll_worker)
 
     def noise_frame(self, image_array):
         # MUST BE SAVED UNDER "SELF" OTHERWISE PYTHON WILL DELETE IN GARBAGE COLLECTION
@@ -57,7 +124,10 @@ class SettingsPanel(tk.Frame):
 
         # create a label widget with the PhotoImage
         image_label = tk.Label(
-            self.main_frame, image=self.photo_image, width=300, height=300
+            self.main_frame,
+            image=self.photo_image,
+            width=PREVIEW_SIZE,
+            height=PREVIEW_SIZE,
         )
         image_label.pack(padx=20, pady=20)
         return image_label
@@ -65,7 +135,9 @@ class SettingsPanel(tk.Frame):
     def on_value_change(self):
         # update image in viewport
         self.photo_image = self.procedural_array_to_image()
-        self.image_label.configure(image=self.photo_image, width=300, height=300)
+        self.image_label.configure(
+            image=self.photo_image, width=PREVIEW_SIZE, height=PREVIEW_SIZE
+        )
 
     def center_window(self, window):
         window.update_idletasks()  # Ensure the window has its correct size
@@ -310,6 +382,17 @@ class SettingsPanel(tk.Frame):
                     "values": self.get_setting_presets(),
                 },
             },
+            {
+                "getter": self.controller.get_seed,
+                "input_creator": SliderControl,
+                "input_args": {
+                    "command": self.controller.set_seed,
+                    "parent": generator_settings_frame,
+                    "label_text": "Seed",
+                    "from_": 0,
+                    "to": 1000,
+                },
+            },
             {
                 "getter": self.controller.get_width,  # the value from the input
                 "input_creator": SliderControl,
@@ -422,6 +505,71 @@ class SettingsPanel(tk.Frame):
                     "to": 90,
                 },
             },
+            {
+                "getter": self.controller.get_tiles,
+                "input_creator": SliderControl,
+                "input_args": {
+                    "parent": misc_frame,
+                    "label_text": "Tiles per side",
+                    "command": self.controller.set_tiles,
+                    "from_": 1,
+                    "to": 16,
+                },
+            },
+            {
+                "getter": self.controller.get_mesh_format,
+                "input_creator": Dropdown,
+                "input_args": {
+                    "command": self.controller.set_mesh_format,
+                    "parent": misc_frame,
+                    "default": self.controller.get_mesh_format(),
+                    "values": self.controller.get_mesh_formats(),
+                },
+            },
+            {
+                "getter": self.controller.get_max_error,
+                "input_creator": SliderControl,
+                "input_args": {
+                    "parent": misc_frame,
+                    "label_text": "Mesh max error",
+                    "command": self.controller.set_max_error,
+                    "from_": 0,
+                    "to": 1,
+                    "resolution": 0.01,
+                },
+            },
+            {
+                "getter": self.controller.get_collision_max_error,
+                "input_creator": SliderControl,
+                "input_args": {
+                    "parent": misc_frame,
+                    "label_text": "Collision max error",
+                    "command": self.controller.set_collision_max_error,
+                    "from_": 0,
+                    "to": 1,
+                    "resolution": 0.01,
+                },
+            },
+            {
+                "getter": self.controller.get_instance_mode,
+                "input_creator": Dropdown,
+                "input_args": {
+                    "command": self.controller.set_instance_mode,
+                    "parent": misc_frame,
+                    "default": self.controller.get_instance_mode(),
+                    "values": self.controller.get_instance_modes(),
+                },
+            },
+            {
+                "getter": self.controller.get_ground_type,
+                "input_creator": Dropdown,
+                "input_args": {
+                    "command": self.controller.set_ground_type,
+                    "parent": misc_frame,
+                    "default": self.controller.get_ground_type(),
+                    "values": self.controller.get_ground_types(),
+                },
+            },
             {
                 "getter": self.controller.get_total_grass,
                 "input_creator": SliderControl,
@@ -451,4 +599,20 @@ class SettingsPanel(tk.Frame):
 
     def export_world(self):
         self.controller.export_collision_objects()
-        self.controller.export_world("noise_rocky")
+        self.loading_bar.set("Exporting")
+        self.loading_bar.set_breakdown([])
+        instrumentation.add_listener(self.on_export_span)
+        try:
+            self.controller.export_world("noise_rocky")
+        finally:
+            instrumentation.remove_listener(self.on_export_span)
+        self.loading_bar.set("Ready")
+
+    def on_export_span(self, run, span):
+        # the export runs on the UI thread, so redraw now rather than once it's finished.
+        # Spans from any other thread can't touch tkinter
+        if threading.current_thread() is not threading.main_thread():
+            return
+        self.loading_bar.set(f"Exporting, {span['name']} done")
+        self.loading_bar.set_breakdown(run.get_report())
+        self.update_idletasks()